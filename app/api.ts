@@ -11,27 +11,491 @@ const api = axios.create({
   },
 });
 
-interface CodeRequest {
+export interface SelectionRange {
+  start_line: number;
+  end_line: number;
+}
+
+export interface CodeRequest {
   code: string;
   instruction: string;
+  language?: string;
+  selection?: SelectionRange;
+  full_context?: string;
+  full_context_hash?: string;
+  use_groq?: boolean;
+  response_format?: 'full' | 'patch';
+  candidates?: number; // Generate this many results in one round-trip and return the best
+  include_candidates?: boolean; // Also return the runners-up
 }
 
-interface CodeResponse {
+export interface CandidateInfo {
   modified_code: string;
   explanation: string;
+  provider: string;
+  model: string;
+  valid: boolean;
+  diff_lines: number;
+}
+
+export interface CodeResponse {
+  modified_code: string;
+  explanation: string;
+  candidates?: CandidateInfo[];
+}
+
+// Replaces `delete` lines at 0-based line `start` of the submitted code with `insert`
+export interface PatchHunk {
+  start: number;
+  delete: number;
+  insert: string[];
+}
+
+// What /iterate-code sends back: either the full code or a patch against the submitted code
+interface WireResponse {
+  modified_code?: string;
+  explanation: string;
+  patch?: PatchHunk[];
+  candidates?: CandidateInfo[];
+}
+
+export interface IterateOptions {
+  // Abort the request (or the debounce wait before it)
+  signal?: AbortSignal;
+  // Wait this long before sending, so superseded submissions never reach the server
+  debounceMs?: number;
+  // Called as response bytes arrive
+  onProgress?: (receivedBytes: number) => void;
+  // Skip the cache lookup (the fresh result is still cached)
+  bypassCache?: boolean;
+}
+
+// How many results to keep in memory and in IndexedDB, and how long cached results stay valid
+const MEMORY_CACHE_SIZE = 50;
+const PERSISTENT_CACHE_SIZE = 200;
+const CACHE_TTL_MS = 24 * 60 * 60 * 1000;
+
+// The backend appends this to the explanation when the code failed validation.
+// Such results are not cached, so submitting again asks for a new one.
+const VALIDATION_WARNING = 'Warning: the modified code may contain a syntax error';
+
+// Contexts at least this long are uploaded once and then sent by hash
+const CONTEXT_BY_HASH_MIN_CHARS = 8 * 1024;
+// Request bodies at least this large are gzip-compressed when the browser supports it
+const COMPRESS_REQUEST_MIN_BYTES = 16 * 1024;
+
+const DB_NAME = 'code-iterator-cache';
+const DB_STORE = 'results';
+const DB_VERSION = 2;
+const DB_STORED_AT_INDEX = 'storedAt';
+
+interface CacheEntry {
+  key: string;
+  storedAt: number;
+  response: CodeResponse;
+}
+
+// Map keeps insertion order, so the first key is always the least recently used
+const memoryCache = new Map<string, CacheEntry>();
+
+// Identical requests that are already on the wire share one network call
+interface InFlight {
+  promise: Promise<CodeResponse>;
+  controller: AbortController;
+  subscribers: number;
+}
+const inFlight = new Map<string, InFlight>();
+
+export class RequestAbortedError extends Error {
+  constructor() {
+    super('Request aborted');
+    this.name = 'RequestAbortedError';
+  }
 }
 
-export const iterateCode = async (data: CodeRequest): Promise<CodeResponse> => {
+export const isAbortError = (error: unknown): boolean =>
+  error instanceof RequestAbortedError || (error instanceof Error && error.name === 'AbortError');
+
+// FNV-1a, used when SubtleCrypto is unavailable (e.g. plain http on a LAN address)
+const fnv1a = (text: string): string => {
+  let hash = 0x811c9dc5;
+  for (let i = 0; i < text.length; i++) {
+    hash ^= text.charCodeAt(i);
+    hash = Math.imul(hash, 0x01000193);
+  }
+  return (hash >>> 0).toString(16).padStart(8, '0') + text.length.toString(16);
+};
+
+const hasSubtleCrypto = (): boolean => typeof crypto !== 'undefined' && !!crypto.subtle;
+
+// Content hash of a string - SHA-256 where available
+export const hashContent = async (text: string): Promise<string> => {
+  if (!hasSubtleCrypto()) {
+    return fnv1a(text);
+  }
+  const digest = new Uint8Array(await crypto.subtle.digest('SHA-256', new TextEncoder().encode(text)));
+  let hex = '';
+  for (let i = 0; i < digest.length; i++) {
+    hex += digest[i].toString(16).padStart(2, '0');
+  }
+  return hex;
+};
+
+const requestKey = (data: CodeRequest): Promise<string> =>
+  hashContent(JSON.stringify([
+    data.code,
+    data.instruction,
+    data.language,
+    data.selection?.start_line,
+    data.selection?.end_line,
+    data.full_context,
+    data.use_groq,
+    data.candidates,
+    data.include_candidates,
+  ]));
+
+let dbPromise: Promise<IDBDatabase | null> | null = null;
+
+const openDb = (): Promise<IDBDatabase | null> => {
+  if (!dbPromise) {
+    dbPromise = new Promise((resolve) => {
+      if (typeof indexedDB === 'undefined') {
+        resolve(null);
+        return;
+      }
+      const request = indexedDB.open(DB_NAME, DB_VERSION);
+      request.onupgradeneeded = () => {
+        const db = request.result;
+        const store = db.objectStoreNames.contains(DB_STORE)
+          ? request.transaction!.objectStore(DB_STORE)
+          : db.createObjectStore(DB_STORE, { keyPath: 'key' });
+        // Index by age so expired and excess entries can be pruned oldest first
+        if (!store.indexNames.contains(DB_STORED_AT_INDEX)) {
+          store.createIndex(DB_STORED_AT_INDEX, 'storedAt');
+        }
+      };
+      request.onsuccess = () => resolve(request.result);
+      // The cache is best effort - private browsing and quota errors just disable it
+      request.onerror = () => resolve(null);
+    });
+  }
+  return dbPromise;
+};
+
+const readPersistent = async (key: string): Promise<CacheEntry | null> => {
+  const db = await openDb();
+  if (!db) return null;
+  return new Promise((resolve) => {
+    try {
+      const request = db.transaction(DB_STORE, 'readonly').objectStore(DB_STORE).get(key);
+      request.onsuccess = () => resolve((request.result as CacheEntry | undefined) || null);
+      request.onerror = () => resolve(null);
+    } catch {
+      resolve(null);
+    }
+  });
+};
+
+// Delete expired entries, then the oldest ones beyond PERSISTENT_CACHE_SIZE
+const prunePersistent = (store: IDBObjectStore) => {
+  const byAge = store.index(DB_STORED_AT_INDEX);
+  const expired = byAge.openCursor(IDBKeyRange.upperBound(Date.now() - CACHE_TTL_MS));
+  expired.onsuccess = () => {
+    const cursor = expired.result;
+    if (cursor) {
+      cursor.delete();
+      cursor.continue();
+      return;
+    }
+    const count = store.count();
+    count.onsuccess = () => {
+      let excess = count.result - PERSISTENT_CACHE_SIZE;
+      if (excess <= 0) return;
+      const oldest = byAge.openCursor();
+      oldest.onsuccess = () => {
+        const next = oldest.result;
+        if (!next || excess <= 0) return;
+        next.delete();
+        excess--;
+        next.continue();
+      };
+    };
+  };
+};
+
+const writePersistent = async (entry: CacheEntry): Promise<void> => {
+  const db = await openDb();
+  if (!db) return;
   try {
-    const response = await api.post<CodeResponse>('/iterate-code', data);
-    return response.data;
-  } catch (error: unknown) {
-    if (axios.isAxiosError(error)) {
-      const errorMessage = error.response?.data?.detail || error.message;
-      throw new Error(`API Error: ${errorMessage}`);
+    const store = db.transaction(DB_STORE, 'readwrite').objectStore(DB_STORE);
+    store.put(entry);
+    prunePersistent(store);
+  } catch {
+    // Ignore - the in-memory cache still has the entry
+  }
+};
+
+const rememberInMemory = (entry: CacheEntry) => {
+  memoryCache.delete(entry.key);
+  memoryCache.set(entry.key, entry);
+  if (memoryCache.size > MEMORY_CACHE_SIZE) {
+    memoryCache.delete(memoryCache.keys().next().value as string);
+  }
+};
+
+const lookupCache = async (key: string): Promise<CodeResponse | null> => {
+  const now = Date.now();
+  const cached = memoryCache.get(key) || (await readPersistent(key));
+  if (!cached || now - cached.storedAt > CACHE_TTL_MS) {
+    return null;
+  }
+  rememberInMemory(cached);
+  return cached.response;
+};
+
+const storeInCache = (key: string, response: CodeResponse) => {
+  if (response.explanation.includes(VALIDATION_WARNING)) return;
+  const entry = { key, storedAt: Date.now(), response };
+  rememberInMemory(entry);
+  void writePersistent(entry);
+};
+
+// Empty both cache layers
+export const clearResultCache = async (): Promise<void> => {
+  memoryCache.clear();
+  const db = await openDb();
+  if (!db) return;
+  try {
+    db.transaction(DB_STORE, 'readwrite').objectStore(DB_STORE).clear();
+  } catch {
+    // Ignore
+  }
+};
+
+const wait = (ms: number, signal?: AbortSignal): Promise<void> =>
+  new Promise((resolve, reject) => {
+    if (signal?.aborted) {
+      reject(new RequestAbortedError());
+      return;
+    }
+    const timer = setTimeout(() => {
+      signal?.removeEventListener('abort', onAbort);
+      resolve();
+    }, ms);
+    const onAbort = () => {
+      clearTimeout(timer);
+      reject(new RequestAbortedError());
+    };
+    signal?.addEventListener('abort', onAbort);
+  });
+
+// Read the response body chunk by chunk, reporting progress as it arrives
+const readBody = async (response: Response, onProgress?: (receivedBytes: number) => void): Promise<string> => {
+  if (!response.body || !onProgress) {
+    return response.text();
+  }
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let received = 0;
+  let text = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    received += value.byteLength;
+    text += decoder.decode(value, { stream: true });
+    onProgress(received);
+  }
+  return text + decoder.decode();
+};
+
+class ApiStatusError extends Error {
+  constructor(public status: number, detail: string) {
+    super(`API Error: ${detail}`);
+  }
+}
+
+// Gzip the body when it is large enough to be worth it and the browser can do it
+const encodeBody = async (body: string): Promise<{ body: BodyInit; headers: Record<string, string> }> => {
+  const headers: Record<string, string> = { 'Content-Type': 'application/json' };
+  if (body.length < COMPRESS_REQUEST_MIN_BYTES || typeof CompressionStream === 'undefined') {
+    return { body, headers };
+  }
+  const compressed = await new Response(
+    new Blob([body]).stream().pipeThrough(new CompressionStream('gzip'))
+  ).arrayBuffer();
+  headers['Content-Encoding'] = 'gzip';
+  return { body: compressed, headers };
+};
+
+const postJson = async <T>(
+  path: string,
+  payload: unknown,
+  signal: AbortSignal,
+  onProgress?: (receivedBytes: number) => void
+): Promise<T> => {
+  const { body, headers } = await encodeBody(JSON.stringify(payload));
+  const response = await fetch(`${API_URL}${path}`, { method: 'POST', headers, body, signal });
+  const text = await readBody(response, onProgress);
+
+  if (!response.ok) {
+    let errorMessage = `${response.status} ${response.statusText}`;
+    try {
+      errorMessage = JSON.parse(text).detail || errorMessage;
+    } catch {
+      // Not JSON - keep the status line
+    }
+    throw new ApiStatusError(response.status, errorMessage);
+  }
+  return JSON.parse(text) as T;
+};
+
+// Hashes of contexts the server is known to have
+const uploadedContexts = new Set<string>();
+
+const uploadContext = async (content: string, signal: AbortSignal): Promise<string> => {
+  const { hash } = await postJson<{ hash: string }>('/contexts', { content }, signal);
+  uploadedContexts.add(hash);
+  return hash;
+};
+
+export const applyPatch = (original: string, patch: PatchHunk[]): string => {
+  const lines = original.split('\n');
+  // Hunks are in ascending order, so applying them back to front keeps earlier offsets valid
+  for (let i = patch.length - 1; i >= 0; i--) {
+    const hunk = patch[i];
+    lines.splice(hunk.start, hunk.delete, ...hunk.insert);
+  }
+  return lines.join('\n');
+};
+
+const postIterateCode = async (
+  data: CodeRequest,
+  signal: AbortSignal,
+  onProgress?: (receivedBytes: number) => void
+): Promise<CodeResponse> => {
+  const payload: CodeRequest = { ...data, response_format: 'patch' };
+
+  // Send large contexts by hash - the server only needs the full text once
+  let contextHash: string | undefined;
+  if (data.full_context && data.full_context.length >= CONTEXT_BY_HASH_MIN_CHARS && hasSubtleCrypto()) {
+    contextHash = await hashContent(data.full_context);
+    if (!uploadedContexts.has(contextHash)) {
+      contextHash = await uploadContext(data.full_context, signal);
     }
-    throw error;
+    payload.full_context = undefined;
+    payload.full_context_hash = contextHash;
+  }
+
+  let response: WireResponse;
+  try {
+    response = await postJson<WireResponse>('/iterate-code', payload, signal, onProgress);
+  } catch (error) {
+    // 409: the server evicted (or never had) the context - upload it and retry once
+    if (!(error instanceof ApiStatusError && error.status === 409 && contextHash && data.full_context)) {
+      throw error;
+    }
+    uploadedContexts.delete(contextHash);
+    payload.full_context_hash = await uploadContext(data.full_context, signal);
+    response = await postJson<WireResponse>('/iterate-code', payload, signal, onProgress);
+  }
+
+  const modifiedCode = response.patch ? applyPatch(data.code, response.patch) : response.modified_code ?? '';
+  return { modified_code: modifiedCode, explanation: response.explanation, candidates: response.candidates };
+};
+
+// Subscribe to an in-flight request; the network call is only aborted once every subscriber has aborted
+const subscribe = (entry: InFlight, signal?: AbortSignal): Promise<CodeResponse> => {
+  entry.subscribers += 1;
+  if (!signal) {
+    return entry.promise;
   }
+  return new Promise((resolve, reject) => {
+    const onAbort = () => {
+      entry.subscribers -= 1;
+      if (entry.subscribers === 0) {
+        entry.controller.abort();
+      }
+      reject(new RequestAbortedError());
+    };
+    if (signal.aborted) {
+      onAbort();
+      return;
+    }
+    signal.addEventListener('abort', onAbort);
+    entry.promise.then(
+      (result) => {
+        signal.removeEventListener('abort', onAbort);
+        resolve(result);
+      },
+      (error) => {
+        signal.removeEventListener('abort', onAbort);
+        reject(error);
+      }
+    );
+  });
+};
+
+export const iterateCode = async (data: CodeRequest, options: IterateOptions = {}): Promise<CodeResponse> => {
+  const { signal, debounceMs = 0, onProgress, bypassCache = false } = options;
+
+  if (debounceMs > 0) {
+    await wait(debounceMs, signal);
+  }
+
+  const key = await requestKey(data);
+  if (!bypassCache) {
+    const cached = await lookupCache(key);
+    if (cached) return cached;
+  }
+  if (signal?.aborted) {
+    throw new RequestAbortedError();
+  }
+
+  let entry = inFlight.get(key);
+  if (!entry) {
+    const controller = new AbortController();
+    const created: InFlight = {
+      controller,
+      subscribers: 0,
+      promise: postIterateCode(data, controller.signal, onProgress)
+        .then((result) => {
+          storeInCache(key, result);
+          return result;
+        })
+        .finally(() => {
+          inFlight.delete(key);
+        }),
+    };
+    // Avoid unhandled rejections when every subscriber has already aborted
+    created.promise.catch(() => undefined);
+    inFlight.set(key, created);
+    entry = created;
+  }
+
+  return subscribe(entry, signal);
+};
+
+// Replace lines startLine..endLine (1-based, inclusive) of fullCode without splitting the whole file
+export const mergeSelection = (fullCode: string, startLine: number, endLine: number, replacement: string): string => {
+  const lineOffset = (line: number): number => {
+    let offset = 0;
+    for (let current = 1; current < line; current++) {
+      const next = fullCode.indexOf('\n', offset);
+      if (next === -1) return -1;
+      offset = next + 1;
+    }
+    return offset;
+  };
+
+  const start = lineOffset(startLine);
+  if (start === -1) {
+    return fullCode + (fullCode ? '\n' : '') + replacement;
+  }
+  const afterEnd = lineOffset(endLine + 1);
+  const before = fullCode.slice(0, start);
+  const after = afterEnd === -1 ? '' : fullCode.slice(afterEnd);
+
+  return before + replacement + (after ? '\n' : '') + after;
 };
 
-export default api; 
\ No newline at end of file
+export default api;
@@ -1,5 +1,6 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any, List
 import requests
@@ -7,7 +8,18 @@ import os
 import json
 import traceback
 import re
+import time
+import asyncio
+import contextvars
 from dotenv import load_dotenv
+from recorder import TrafficRecorder, read_traffic_log
+from validation import ValidationResult, validate_code, record_repair, get_validation_stats
+from transport import BrotliMiddleware, ContextStore, RequestDecompressionMiddleware, make_patch
+from candidates import Candidate, rank_candidates
+from routing import Router
+from tracing import (
+    Trace, RequestProfiler, current_trace, span, add_completed_span, export_trace, parse_trace_mode,
+)
 
 # Load environment variables
 load_dotenv()
@@ -18,6 +30,21 @@ app = FastAPI(
     version="0.1.0",
 )
 
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Upper bound for an inflated gzip request body
+MAX_REQUEST_BODY_BYTES = int(os.getenv("MAX_REQUEST_BODY_BYTES", str(20 * 1024 * 1024)))
+# Memory budget for full_context uploads referenced by hash
+CONTEXT_STORE_MAX_BYTES = int(os.getenv("CONTEXT_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Compress responses (brotli when brotli-asgi is installed, gzip otherwise) and accept gzip request bodies.
+# Added before CORS so that CORS stays the outermost middleware.
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MIN_SIZE, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+app.add_middleware(RequestDecompressionMiddleware, max_size=MAX_REQUEST_BODY_BYTES)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -40,6 +67,46 @@ GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
 # Whether to use Groq API as default (True) or Ollama (False)
 USE_GROQ_DEFAULT = os.getenv("USE_GROQ_DEFAULT", "True").lower() in ["true", "1", "yes"]
 
+# Whether to syntax-check generated code before returning it
+VALIDATE_OUTPUT = os.getenv("VALIDATE_OUTPUT", "True").lower() in ["true", "1", "yes"]
+# Whether to ask the same model once to fix code that failed validation
+VALIDATION_RETRY = os.getenv("VALIDATION_RETRY", "True").lower() in ["true", "1", "yes"]
+
+# Upper bound for CodeRequest.candidates
+MAX_CANDIDATES = int(os.getenv("MAX_CANDIDATES", "5"))
+
+# Opt-in traffic recorder (RECORD_TRAFFIC=True), None when disabled
+recorder = TrafficRecorder.from_env()
+
+# Adaptive provider ordering learned from attempt latency and outcomes
+ROUTING_ENABLED = os.getenv("ROUTING_ENABLED", "True").lower() in ["true", "1", "yes"]
+router = Router(
+    exploration_rate=float(os.getenv("ROUTING_EXPLORATION_RATE", "0.1")),
+    decay=float(os.getenv("ROUTING_DECAY", "0.1")),
+    min_attempts=int(os.getenv("ROUTING_MIN_ATTEMPTS", "3")),
+)
+# Start from the recorded traffic instead of an empty table
+if recorder is not None and os.path.exists(recorder.path):
+    try:
+        print(f"Seeded router with {router.seed_from_records(read_traffic_log(recorder.path))} recorded attempts")
+    except Exception as e:
+        print(f"Failed to seed router from {recorder.path}: {str(e)}")
+
+# Token for /admin endpoints - when unset they are open, like the rest of the API
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Per-request traces, written to TRACE_DIR for requests sent with X-Trace or ?trace=
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+# "chrome" (chrome://tracing / Perfetto) or "otlp" (OpenTelemetry JSON)
+TRACE_FORMAT = os.getenv("TRACE_FORMAT", "chrome").lower()
+# Also keep the trace of any request slower than this (0 disables slow-request sampling)
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))
+# Keep at most this many traces in TRACE_DIR, deleting the oldest (0 keeps everything)
+TRACE_MAX_FILES = int(os.getenv("TRACE_MAX_FILES", "100"))
+
+# Uploaded full_context files, referenced from requests by content hash
+context_store = ContextStore(CONTEXT_STORE_MAX_BYTES)
+
 class SelectionInfo(BaseModel):
     start_line: int
     end_line: int
@@ -50,11 +117,36 @@ class CodeRequest(BaseModel):
     language: str = "javascript"  # Default to JavaScript if not specified
     selection: Optional[SelectionInfo] = None
     full_context: Optional[str] = None  # The full code when a selection is provided
+    full_context_hash: Optional[str] = None  # Hash of a full_context uploaded to /contexts, instead of full_context
     use_groq: Optional[bool] = None  # Optional override for using Groq API
+    response_format: str = "full"  # "full" for the complete modified code, "patch" for a patch against code
+    candidates: int = 1  # Number of results to generate concurrently; the best one is returned
+    include_candidates: bool = False  # Also return the other ranked candidates
 
-class CodeResponse(BaseModel):
+class PatchHunk(BaseModel):
+    start: int  # 0-based line in the submitted code
+    delete: int  # Number of lines removed at start
+    insert: List[str]  # Lines inserted in their place
+
+class CandidateInfo(BaseModel):
     modified_code: str
     explanation: str
+    provider: str
+    model: str
+    valid: bool
+    diff_lines: int
+
+class CodeResponse(BaseModel):
+    modified_code: Optional[str] = None  # Omitted when a patch is returned
+    explanation: str
+    patch: Optional[List[PatchHunk]] = None
+    candidates: Optional[List[CandidateInfo]] = None  # Runner-up candidates, best first
+
+class ContextUpload(BaseModel):
+    content: str
+
+class ContextReference(BaseModel):
+    hash: str
 
 class ChatMessage(BaseModel):
     role: str
@@ -64,6 +156,30 @@ class ChatMessage(BaseModel):
 def read_root():
     return {"message": "Code Iterator AI API is running"}
 
+@app.post("/contexts", response_model=ContextReference)
+def upload_context(upload: ContextUpload):
+    """Store a file so later requests can reference it by hash instead of resending it"""
+    try:
+        digest = context_store.put(upload.content)
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    print(f"Stored context {digest[:12]}... ({len(upload.content)} chars, {len(context_store)} contexts)")
+    return ContextReference(hash=digest)
+
+@app.get("/admin/routing")
+def read_routing_table(x_admin_token: Optional[str] = Header(None)):
+    """Return the learned routing statistics per language and code size bucket"""
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    table = router.table()
+    table["enabled"] = ROUTING_ENABLED
+    return table
+
+@app.get("/metrics")
+def read_metrics():
+    """Return in-process counters, e.g. how often and how long output validation ran"""
+    return {"validation": get_validation_stats()}
+
 def try_generate_with_model(model, prompt):
     """Try to generate a response with the specified Ollama model"""
     print(f"Trying to generate with Ollama model: {model}")
@@ -143,7 +259,7 @@ def try_generate_with_groq(prompt, model=GROQ_MODEL):
     # Extract the assistant's message content
     if data.get("choices") and len(data["choices"]) > 0:
         ai_response = data["choices"][0]["message"]["content"]
-        return {"response": ai_response}
+        return {"response": ai_response, "usage": data.get("usage") or {}}
     else:
         raise ValueError("Unexpected response format from Groq API")
 
@@ -151,6 +267,22 @@ def extract_code_and_explanation(ai_response, language, original_code):
     """
     Extract code and explanation from the AI response using multiple strategies
     """
+    modified_code, explanation, _ = extract_with_strategy(ai_response, language, original_code)
+    return modified_code, explanation
+
+def extract_with_strategy(ai_response, language, original_code):
+    """
+    Same as extract_code_and_explanation, but also returns the name of the strategy that produced the result
+    """
+    with span("extract", response_length=len(ai_response or "")) as current:
+        result = run_extraction_strategies(ai_response, language, original_code)
+        current.set(strategy=result[2])
+        return result
+
+def run_extraction_strategies(ai_response, language, original_code):
+    """
+    Try each extraction strategy in turn, returning (code, explanation, strategy)
+    """
     # Save original response for debugging
     full_response = ai_response
     
@@ -181,7 +313,7 @@ def extract_code_and_explanation(ai_response, language, original_code):
             if code_blocks:
                 modified_code = code_blocks[0].strip()
                 print(f"Successfully extracted with Strategy 1 - Explanation length: {len(explanation)}, Code length: {len(modified_code)}")
-                return modified_code, explanation
+                return modified_code, explanation, "markers"
         
         # Strategy 2: Look for markdown code blocks directly
         code_blocks = re.findall(r"```(?:\w+)?\s*([\s\S]*?)\s*```", ai_response)
@@ -205,9 +337,9 @@ def extract_code_and_explanation(ai_response, language, original_code):
             # Return original code if the modified code is empty or just whitespace
             if not modified_code.strip() or len(modified_code) < 10:
                 print("Warning: Modified code is too short, falling back to original")
-                return original_code, explanation + "\n\nNote: The AI did not provide valid modified code, showing original."
+                return original_code, explanation + "\n\nNote: The AI did not provide valid modified code, showing original.", "too_short"
                 
-            return modified_code, explanation
+            return modified_code, explanation, "code_block"
         
         # Strategy 3: Check for specific Python code patterns even without code blocks 
         # (sometimes the model forgets to wrap code in backticks)
@@ -223,7 +355,7 @@ def extract_code_and_explanation(ai_response, language, original_code):
                         explanation = parts[0].strip()
                         modified_code = parts[1].strip()
                         print(f"Found code separator: '{separator}'")
-                        return modified_code, explanation
+                        return modified_code, explanation, "python_separator"
         
         # Strategy 3: If there are no code blocks but we have clear differences, use the whole response as explanation
         print(f"Strategy 3 - Checking if response differs from original (original length: {len(original_code)}, response length: {len(ai_response)})")
@@ -233,25 +365,396 @@ def extract_code_and_explanation(ai_response, language, original_code):
             # Try to detect if the response itself is code
             if ai_response.strip().startswith(("def ", "class ", "function", "import ", "from ", "#", "//")):
                 print("Response appears to be code")
-                return ai_response.strip(), "The AI provided modified code without explanation."
+                return ai_response.strip(), "The AI provided modified code without explanation.", "raw_code"
             else:
                 print("Response appears to be explanation only")
-                return original_code, ai_response.strip()
+                return original_code, ai_response.strip(), "explanation_only"
         
         # If all else fails, return original with error
         print("All parsing strategies failed")
         # In this case, return the original code but with a warning message
-        return original_code, f"The AI was unable to generate modified code. Please try a different instruction. Here's what it said: {ai_response[:500]}..."
+        return original_code, f"The AI was unable to generate modified code. Please try a different instruction. Here's what it said: {ai_response[:500]}...", "failed"
         
     except Exception as e:
         print(f"Error parsing AI response: {str(e)}")
         print(traceback.format_exc())
-        return original_code, f"Error parsing AI response: {str(e)}. Raw response: {full_response[:300]}..."
+        return original_code, f"Error parsing AI response: {str(e)}. Raw response: {full_response[:300]}...", "error"
+
+def record_attempt(request, prompt, provider, model, raw_response, strategy, timings, outcome, error=None):
+    """Feed one provider attempt to the router, and append it to the traffic log when recording is enabled"""
+    # Repairs use a different prompt, so they say little about how the model handles the request itself
+    if not outcome.startswith("repair_"):
+        router.observe(provider, model, request.language, len(request.code), outcome, strategy,
+                       timings.get("provider_ms"))
+    if recorder is None:
+        return
+    try:
+        recorder.record({
+            "request": request.model_dump(),
+            "prompt": prompt,
+            "provider": provider,
+            "model": model,
+            "raw_response": raw_response,
+            "strategy": strategy,
+            "timings": timings,
+            "outcome": outcome,
+            "error": error,
+        })
+    except Exception as e:
+        # Recording must never break a user request
+        print(f"Failed to record traffic: {str(e)}")
+
+def generate_with_provider(provider, model, prompt):
+    """Call the given provider ("groq" or "ollama") and return the raw response text"""
+    with span("provider", provider=provider, model=model, prompt_length=len(prompt)) as current:
+        started_ns = time.time_ns()
+        if provider == "groq":
+            data = try_generate_with_groq(prompt, model)
+        else:
+            data = try_generate_with_model(model, prompt)
+        if current_trace.get() is not None:
+            trace_provider_timings(current, provider, data, started_ns)
+        response = data.get("response", "")
+        current.set(response_length=len(response))
+        return response
+
+def trace_provider_timings(current, provider, data, started_ns):
+    """
+    Add the server-side phases the provider reports as child spans of the provider span.
+    Whatever the provider span takes beyond server_ms is network and client overhead.
+    """
+    if provider == "groq":
+        # Groq reports seconds in usage: time spent queued, then processing the prompt, then generating
+        usage = data.get("usage") or {}
+        phases = [(name, (usage.get(key) or 0) * 1000)
+                  for name, key in [("groq.queue", "queue_time"), ("groq.prompt", "prompt_time"),
+                                    ("groq.completion", "completion_time")]]
+        server_ms = (usage.get("total_time") or 0) * 1000 + phases[0][1]
+    else:
+        # Ollama reports nanoseconds: loading the model into memory, prompt evaluation, then generation
+        phases = [(name, (data.get(key) or 0) / 1e6)
+                  for name, key in [("ollama.load_model", "load_duration"),
+                                    ("ollama.prompt_eval", "prompt_eval_duration"),
+                                    ("ollama.eval", "eval_duration")]]
+        server_ms = (data.get("total_duration") or 0) / 1e6
+    
+    offset_ns = started_ns
+    for name, duration_ms in phases:
+        add_completed_span(name, duration_ms, offset_ns)
+        offset_ns += int(duration_ms * 1e6)
+    current.set(server_ms=round(server_ms, 3))
+
+def check_output(modified_code, request):
+    """Validate extracted code for the request language, unless validation is disabled"""
+    if not VALIDATE_OUTPUT:
+        return ValidationResult(ok=True)
+    with span("validate", language=request.language) as current:
+        validation = validate_code(modified_code, request.language, request.code)
+        current.set(ok=validation.ok, validator=validation.validator or "")
+    if not validation.ok:
+        print(f"Validation failed ({validation.validator}): {validation.error}")
+    return validation
+
+def validation_warning(validation):
+    """Note appended to the explanation when returned code failed validation"""
+    return f"\n\nWarning: the modified code may contain a syntax error: {validation.error}"
+
+def attempt_outcome(unchanged, validation):
+    """Outcome label for a recorded attempt"""
+    if unchanged:
+        return "unchanged"
+    return "ok" if validation.ok else "invalid"
+
+def build_repair_prompt(request, broken_code, error):
+    """Prompt asking the model to fix a syntax error in code it just generated"""
+    return f"""
+You are a professional coding assistant. The following {request.language} code was generated for the instruction below, but it does not parse.
+
+INSTRUCTION:
+{request.instruction}
+
+CODE WITH ERROR:
+```{request.language}
+{broken_code}
+```
+
+ERROR:
+{error}
+
+Fix the error without making any other changes. Return the complete corrected code in a code block using triple backticks (```).
+
+EXPLANATION:
+[Your explanation here]
+
+MODIFIED CODE:
+```{request.language}
+[Your corrected code here]
+```
+"""
+
+def repair_invalid_code(request, provider, model, broken_code, validation, prompt_ms):
+    """
+    Ask the same model once to fix code that failed validation.
+    Returns (modified_code, validation): the repaired code if it validates, otherwise the broken code unchanged.
+    """
+    if not VALIDATION_RETRY:
+        return broken_code, validation
 
-@app.post("/iterate-code", response_model=CodeResponse)
-async def iterate_code(request: CodeRequest):
+    print(f"Retrying {provider} model {model} to repair invalid code")
+    repair_prompt = build_repair_prompt(request, broken_code, validation.error)
+    ai_response = None
+    try:
+        started = time.perf_counter()
+        ai_response = generate_with_provider(provider, model, repair_prompt)
+        provider_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        repaired_code, _, strategy = extract_with_strategy(ai_response, request.language, broken_code)
+        extract_ms = (time.perf_counter() - started) * 1000
+
+        unchanged = repaired_code in (broken_code, request.code)
+        repaired = None if unchanged else check_output(repaired_code, request)
+        record_attempt(request, repair_prompt, provider, model, ai_response, strategy,
+                       {"prompt_ms": prompt_ms, "provider_ms": provider_ms, "extract_ms": extract_ms,
+                        "validate_ms": repaired.duration_ms if repaired else 0.0},
+                       "repair_" + attempt_outcome(unchanged, repaired))
+
+        succeeded = repaired is not None and repaired.ok
+        record_repair(succeeded)
+        if succeeded:
+            print("Repair retry produced valid code")
+            return repaired_code, repaired
+    except Exception as e:
+        print(f"Repair retry failed: {str(e)}")
+        record_attempt(request, repair_prompt, provider, model, ai_response, None,
+                       {"prompt_ms": prompt_ms}, "repair_error", error=str(e))
+        record_repair(False)
+
+    return broken_code, validation
+
+def route_targets(request, use_groq):
     """
-    Process code with an instruction using either Groq API or Ollama
+    Providers to try for a request, best first.
+    An explicit use_groq choice keeps Groq first; otherwise the router may reorder every target.
+    """
+    targets = [("groq", GROQ_MODEL)] if use_groq else []
+    targets.extend(("ollama", model) for model in OLLAMA_MODELS)
+    if not ROUTING_ENABLED:
+        return targets
+    pinned = 1 if use_groq and request.use_groq else 0
+    routed = router.order(targets, request.language, len(request.code), pinned=pinned)
+    if routed != targets:
+        print(f"Routing order: {', '.join(model for _, model in routed)}")
+    return routed
+
+def generate_candidate(request, prompt, prompt_ms, provider, model):
+    """Generate, extract and validate one candidate. Errors are stored on the candidate instead of raised."""
+    candidate = Candidate(provider=provider, model=model)
+    ai_response = None
+    started = time.perf_counter()
+    try:
+        ai_response = generate_with_provider(provider, model, prompt)
+        provider_ms = (time.perf_counter() - started) * 1000
+        if not ai_response:
+            raise ValueError(f"Empty response from {model}")
+        
+        extract_started = time.perf_counter()
+        candidate.modified_code, candidate.explanation, candidate.strategy = extract_with_strategy(
+            ai_response, request.language, request.code
+        )
+        extract_ms = (time.perf_counter() - extract_started) * 1000
+        
+        unchanged = not candidate.is_modified(request.code)
+        candidate.validation = None if unchanged else check_output(candidate.modified_code, request)
+        record_attempt(request, prompt, provider, model, ai_response, candidate.strategy,
+                       {"prompt_ms": prompt_ms, "provider_ms": provider_ms, "extract_ms": extract_ms,
+                        "validate_ms": candidate.validation.duration_ms if candidate.validation else 0.0},
+                       attempt_outcome(unchanged, candidate.validation))
+        if unchanged:
+            candidate.error = f"Model {model} did not modify the code"
+    except Exception as e:
+        candidate.error = f"Error with {provider} model {model}: {str(e)}"
+        print(f"CANDIDATE ERROR: {candidate.error}")
+        # Charge the failure the time it cost, e.g. a full timeout
+        record_attempt(request, prompt, provider, model, ai_response, None,
+                       {"prompt_ms": prompt_ms, "provider_ms": (time.perf_counter() - started) * 1000},
+                       "error", error=str(e))
+    candidate.latency_ms = (time.perf_counter() - started) * 1000
+    return candidate
+
+async def generate_ranked_response(request, prompt, prompt_ms, use_groq):
+    """
+    Generate request.candidates results concurrently, rank them locally and return the best.
+    Groq candidates are tried first (when enabled), then candidates spread across OLLAMA_MODELS.
+    """
+    loop = asyncio.get_running_loop()
+    batches = []
+    if use_groq:
+        batches.append([("groq", GROQ_MODEL)] * request.candidates)
+    ollama_models = [model for provider, model in route_targets(request, False)]
+    batches.append([("ollama", ollama_models[i % len(ollama_models)]) for i in range(request.candidates)])
+    
+    all_errors = []
+    best_invalid = None
+    for targets in batches:
+        print(f"Generating {len(targets)} candidates with {targets[0][0]}")
+        # The provider clients are blocking, so each candidate runs in its own worker thread.
+        # Each gets a copy of the context so its spans land in the request trace, if any.
+        candidates = await asyncio.gather(*[
+            loop.run_in_executor(None, contextvars.copy_context().run,
+                                 generate_candidate, request, prompt, prompt_ms, provider, model)
+            for provider, model in targets
+        ])
+        ranked = rank_candidates(list(candidates), request.code)
+        all_errors.extend(candidate.error for candidate in ranked if candidate.error)
+        
+        usable = [candidate for candidate in ranked if candidate.is_modified(request.code)]
+        if not usable:
+            continue
+        best = usable[0]
+        print(f"Best of {len(ranked)} candidates: {best.provider} {best.model}, valid={best.is_valid}, diff_lines={best.diff_lines}")
+        
+        if best.is_valid:
+            return ranked_response(request, best, usable[1:])
+        if best.validation.heuristic:
+            # A bracket-check failure may be a false positive - warn instead of trying the next provider
+            response = ranked_response(request, best, usable[1:])
+            response.explanation += validation_warning(best.validation)
+            return response
+        if best_invalid is None:
+            best_invalid = (best, usable[1:])
+    
+    # Nothing valid was produced - prefer returning broken code with a warning over an error
+    if best_invalid is not None:
+        best, others = best_invalid
+        response = ranked_response(request, best, others)
+        response.explanation += validation_warning(best.validation)
+        return response
+    
+    error_detail = "All candidates failed. Errors: " + "; ".join(all_errors)
+    print(f"CRITICAL ERROR: {error_detail}")
+    raise HTTPException(status_code=503, detail=error_detail)
+
+def ranked_response(request, best, others):
+    """CodeResponse for the best candidate, with the runners-up attached when requested"""
+    return CodeResponse(
+        modified_code=best.modified_code,
+        explanation=best.explanation,
+        candidates=[
+            CandidateInfo(
+                modified_code=candidate.modified_code,
+                explanation=candidate.explanation,
+                provider=candidate.provider,
+                model=candidate.model,
+                valid=candidate.is_valid,
+                diff_lines=candidate.diff_lines,
+            )
+            for candidate in others
+        ] if request.include_candidates else None,
+    )
+
+@app.post("/iterate-code", response_model=CodeResponse, response_model_exclude_none=True)
+async def iterate_code(
+    request: CodeRequest,
+    response: Response,
+    trace: Optional[str] = Query(None),
+    x_trace: Optional[str] = Header(None),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """
+    Process code with an instruction using either Groq API or Ollama.
+    Send X-Trace: 1 (or ?trace=1) to write a span trace of the request to TRACE_DIR, or "profile" to also profile it.
+    """
+    mode = parse_trace_mode(x_trace if x_trace is not None else trace)
+    # Traces and profiles expose prompts and timings, so they are admin-only when ADMIN_TOKEN is set
+    if mode is not None and ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    if mode is None and TRACE_SLOW_MS <= 0:
+        return await process_iterate_code(request)
+    
+    request_trace = Trace("iterate-code", {
+        "language": request.language,
+        "code_length": len(request.code),
+        "instruction_length": len(request.instruction),
+        "candidates": request.candidates,
+        "sampled": mode is None,
+    })
+    profiler = None
+    if mode == "profile":
+        try:
+            profiler = RequestProfiler()
+            profiler.start()
+        except Exception as e:
+            # e.g. cProfile refuses to start while another request is being profiled
+            print(f"Profiling unavailable, tracing without it: {str(e)}")
+            profiler = None
+    token = current_trace.set(request_trace)
+    error = None
+    try:
+        result = await process_iterate_code(request)
+        request_trace.root.set(status_code=200)
+        return result
+    except HTTPException as e:
+        request_trace.root.set(status_code=e.status_code)
+        error = e
+        raise
+    except Exception:
+        request_trace.root.set(status_code=500)
+        raise
+    finally:
+        current_trace.reset(token)
+        if profiler is not None:
+            try:
+                profiler.stop()
+            except Exception as e:
+                print(f"Failed to stop profiler: {str(e)}")
+                profiler = None
+        request_trace.finish()
+        
+        # Without an explicit request, only keep traces of slow requests
+        duration_ms = request_trace.root.duration_ms
+        if mode is not None or duration_ms >= TRACE_SLOW_MS:
+            try:
+                path = export_trace(request_trace, TRACE_DIR, TRACE_FORMAT, profiler, TRACE_MAX_FILES)
+                print(f"Wrote trace of {duration_ms:.0f} ms request to {path}")
+                # Error responses are built from the exception, not from the injected response
+                if error is not None:
+                    error.headers = dict(error.headers or {}, **{"X-Trace-Id": request_trace.trace_id})
+                else:
+                    response.headers["X-Trace-Id"] = request_trace.trace_id
+            except Exception as e:
+                # Tracing must never break a user request
+                print(f"Failed to write trace: {str(e)}")
+
+async def process_iterate_code(request: CodeRequest):
+    """
+    Validate the request options, resolve the context hash and produce the (full or patch) response
+    """
+    if request.response_format not in ("full", "patch"):
+        raise HTTPException(status_code=400, detail="response_format must be 'full' or 'patch'")
+    if not 1 <= request.candidates <= MAX_CANDIDATES:
+        raise HTTPException(status_code=400, detail=f"candidates must be between 1 and {MAX_CANDIDATES}")
+    
+    # Resolve a context sent by hash - 409 tells the client to upload it again
+    if request.full_context is None and request.full_context_hash:
+        full_context = context_store.get(request.full_context_hash)
+        if full_context is None:
+            raise HTTPException(status_code=409, detail=f"Unknown full_context_hash: {request.full_context_hash}")
+        request.full_context = full_context
+    
+    response = await generate_code_response(request)
+    
+    if request.response_format == "patch":
+        patch = make_patch(request.code, response.modified_code)
+        # A patch only helps if it is smaller than the code it replaces
+        if len(json.dumps(patch)) < len(response.modified_code):
+            return CodeResponse(explanation=response.explanation, patch=patch, candidates=response.candidates)
+    
+    return response
+
+async def generate_code_response(request: CodeRequest):
+    """
+    Build the prompt, call the providers and return the full CodeResponse
     """
     print(f"Received request - Language: {request.language}, Instruction length: {len(request.instruction)}, Code length: {len(request.code)}")
     
@@ -264,6 +767,7 @@ async def iterate_code(request: CodeRequest):
         raise HTTPException(status_code=400, detail="Instruction cannot be empty")
     
     # Create prompt for the model
+    prompt_started = time.perf_counter()
     prompt = ""
     
     # Different prompt based on whether selection is provided
@@ -333,6 +837,9 @@ MODIFIED CODE:
 ```
 """
     
+    prompt_ms = (time.perf_counter() - prompt_started) * 1000
+    add_completed_span("build_prompt", prompt_ms, prompt_length=len(prompt))
+    
     # Pick the API to use - if use_groq is explicitly set, use that value, otherwise use the default
     use_groq = request.use_groq if request.use_groq is not None else USE_GROQ_DEFAULT
     
@@ -341,100 +848,115 @@ MODIFIED CODE:
         print("Groq API key not found in environment variables. Falling back to Ollama.")
         use_groq = False
     
-    if use_groq:
-        # Try with Groq API
+    if request.candidates > 1:
+        return await generate_ranked_response(request, prompt, prompt_ms, use_groq)
+    
+    # Providers to try in order - Groq first, then the Ollama models, reordered by the router
+    targets = route_targets(request, use_groq)
+    
+    # Keep track of errors for all models
+    all_errors = []
+    # Best result that failed validation, returned only if no provider produces valid code
+    invalid_fallback = None
+    
+    for provider, model in targets:
+        ai_response = None  # Reset so a failure never records the previous model's response
+        provider_started = time.perf_counter()
         try:
-            print("Using Groq API for code generation")
-            data = try_generate_with_groq(prompt)
-            
-            # Process the response to extract explanation and modified code
-            ai_response = data.get("response", "")
+            # Try with this model
+            print(f"Attempting to use {provider} model: {model}")
+            ai_response = generate_with_provider(provider, model, prompt)
+            provider_ms = (time.perf_counter() - provider_started) * 1000
             
             if not ai_response:
-                print("Received empty response from Groq API")
-                raise ValueError("Empty response from Groq API")
+                print("Received empty response from model")
+                record_attempt(request, prompt, provider, model, ai_response, None,
+                               {"prompt_ms": prompt_ms, "provider_ms": provider_ms}, "empty")
+                all_errors.append(f"Empty response from {model}")
+                continue
                 
             print(f"Received response of length: {len(ai_response)}")
             
             # Use more robust extraction
-            modified_code, explanation = extract_code_and_explanation(ai_response, request.language, request.code)
+            started = time.perf_counter()
+            modified_code, explanation, strategy = extract_with_strategy(ai_response, request.language, request.code)
+            extract_ms = (time.perf_counter() - started) * 1000
+            
+            unchanged = modified_code == request.code
+            validation = None if unchanged else check_output(modified_code, request)
+            record_attempt(request, prompt, provider, model, ai_response, strategy,
+                           {"prompt_ms": prompt_ms, "provider_ms": provider_ms, "extract_ms": extract_ms,
+                            "validate_ms": validation.duration_ms if validation else 0.0},
+                           attempt_outcome(unchanged, validation))
             
             # Make sure we got something different
-            if modified_code == request.code:
-                print("Modified code is identical to original code, will try Ollama as fallback")
-                use_groq = False  # Fall back to Ollama
-            else:
+            if unchanged:
+                print("Modified code is identical to original code, will try again or use another model")
+                all_errors.append(f"Model {model} did not modify the code")
+                continue
+            
+            if not validation.ok and validation.heuristic:
+                # A bracket-check failure may be a false positive - warn instead of repairing or moving on
+                print("Heuristic validation failed, returning the output with a warning")
                 return CodeResponse(
                     modified_code=modified_code,
-                    explanation=explanation
+                    explanation=explanation + validation_warning(validation)
                 )
+            
+            if not validation.ok:
+                with span("repair", provider=provider, model=model):
+                    modified_code, validation = repair_invalid_code(request, provider, model, modified_code, validation, prompt_ms)
+            
+            if not validation.ok:
+                all_errors.append(f"Model {model} returned code that failed validation: {validation.error}")
+                if invalid_fallback is None:
+                    invalid_fallback = (modified_code, explanation, validation)
+                continue
+            
+            return CodeResponse(
+                modified_code=modified_code,
+                explanation=explanation
+            )
                 
+        except requests.RequestException as e:
+            error_msg = f"Error with model {model}: {str(e)}"
+            print(f"REQUEST ERROR: {error_msg}")
+            print(f"Error details: {traceback.format_exc()}")
+            # Charge the failure the time it cost, e.g. a full timeout
+            record_attempt(request, prompt, provider, model, ai_response, None,
+                           {"prompt_ms": prompt_ms, "provider_ms": (time.perf_counter() - provider_started) * 1000},
+                           "error", error=str(e))
+            all_errors.append(error_msg)
+            # Continue to the next model
+            continue
         except Exception as e:
-            error_msg = f"Error with Groq API: {str(e)}"
-            print(f"GROQ API ERROR: {error_msg}")
+            error_msg = f"Unexpected error with model {model}: {str(e)}"
+            print(f"UNEXPECTED ERROR: {error_msg}")
             print(f"Error details: {traceback.format_exc()}")
-            
-            # Fall back to Ollama
-            print("Falling back to Ollama models")
-            use_groq = False
-    
-    # If Groq is disabled or failed, try with Ollama models
-    if not use_groq:
-        # Keep track of errors for all models
-        all_errors = []
-        
-        for model in OLLAMA_MODELS:
-            try:
-                # Try with this model
-                print(f"Attempting to use model: {model}")
-                data = try_generate_with_model(model, prompt)
-                
-                # Process the response to extract explanation and modified code
-                ai_response = data.get("response", "")
-                
-                if not ai_response:
-                    print("Received empty response from model")
-                    all_errors.append(f"Empty response from {model}")
-                    continue
-                    
-                print(f"Received response of length: {len(ai_response)}")
-                
-                # Use more robust extraction
-                modified_code, explanation = extract_code_and_explanation(ai_response, request.language, request.code)
-                
-                # Make sure we got something different
-                if modified_code == request.code:
-                    print("Modified code is identical to original code, will try again or use another model")
-                    all_errors.append(f"Model {model} did not modify the code")
-                    continue
-                
-                return CodeResponse(
-                    modified_code=modified_code,
-                    explanation=explanation
-                )
-                    
-            except requests.RequestException as e:
-                error_msg = f"Error with model {model}: {str(e)}"
-                print(f"REQUEST ERROR: {error_msg}")
-                print(f"Error details: {traceback.format_exc()}")
-                all_errors.append(error_msg)
-                # Continue to the next model
-                continue
-            except Exception as e:
-                error_msg = f"Unexpected error with model {model}: {str(e)}"
-                print(f"UNEXPECTED ERROR: {error_msg}")
-                print(f"Error details: {traceback.format_exc()}")
-                all_errors.append(error_msg)
-                # Continue to the next model
-                continue
-        
-        # If we get here, all models failed
-        error_detail = "All models failed to process. Errors: " + "; ".join(all_errors)
-        print(f"CRITICAL ERROR: {error_detail}")
-        raise HTTPException(
-            status_code=503,
-            detail=error_detail
+            # Charge the failure the time it cost, e.g. a full timeout
+            record_attempt(request, prompt, provider, model, ai_response, None,
+                           {"prompt_ms": prompt_ms, "provider_ms": (time.perf_counter() - provider_started) * 1000},
+                           "error", error=str(e))
+            all_errors.append(error_msg)
+            # Continue to the next model
+            continue
+    
+    # Nothing valid was produced - prefer returning broken code with a warning over an error
+    if invalid_fallback is not None:
+        modified_code, explanation, validation = invalid_fallback
+        print("Returning output that failed validation, no provider produced valid code")
+        return CodeResponse(
+            modified_code=modified_code,
+            explanation=explanation + validation_warning(validation)
         )
+    
+    # If we get here, all models failed
+    error_detail = "All models failed to process. Errors: " + "; ".join(all_errors)
+    print(f"CRITICAL ERROR: {error_detail}")
+    raise HTTPException(
+        status_code=503,
+        detail=error_detail
+    )
 
 if __name__ == "__main__":
     import uvicorn
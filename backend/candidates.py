@@ -0,0 +1,52 @@
+from dataclasses import dataclass
+from typing import Optional, List, Tuple
+from transport import make_patch
+from validation import ValidationResult
+
+# Extraction strategies that found the code where the prompt asked for it
+CLEAN_STRATEGIES = {"markers", "code_block"}
+
+
+@dataclass
+class Candidate:
+    provider: str
+    model: str
+    modified_code: Optional[str] = None
+    explanation: str = ""
+    strategy: Optional[str] = None
+    validation: Optional[ValidationResult] = None
+    error: Optional[str] = None
+    latency_ms: float = 0.0
+    diff_lines: int = 0
+
+    def is_modified(self, original_code: str) -> bool:
+        return self.modified_code is not None and self.modified_code != original_code
+
+    @property
+    def is_valid(self) -> bool:
+        return self.validation is not None and self.validation.ok
+
+
+def score_candidate(candidate: Candidate, original_code: str) -> Tuple:
+    """
+    Sort key for a candidate, higher is better.
+    Modified code first, then syntax validity, then clean extraction, then the smallest diff, then the fastest.
+    """
+    if not candidate.is_modified(original_code):
+        return (False, False, False, 0, -candidate.latency_ms)
+    return (
+        True,
+        candidate.is_valid,
+        candidate.strategy in CLEAN_STRATEGIES,
+        -candidate.diff_lines,
+        -candidate.latency_ms,
+    )
+
+
+def rank_candidates(candidates: List[Candidate], original_code: str) -> List[Candidate]:
+    """Compute diff sizes and return candidates best first"""
+    for candidate in candidates:
+        if candidate.is_modified(original_code):
+            patch = make_patch(original_code, candidate.modified_code)
+            candidate.diff_lines = sum(hunk["delete"] + len(hunk["insert"]) for hunk in patch)
+    return sorted(candidates, key=lambda candidate: score_candidate(candidate, original_code), reverse=True)
@@ -0,0 +1,25 @@
+import pytest
+from unittest.mock import MagicMock
+
+
+def make_code_block(code, language="python"):
+    return f"EXPLANATION:\nAdded a docstring.\n\nMODIFIED CODE:\n```{language}\n{code}\n```"
+
+
+def make_ollama_response(text, **fields):
+    mock_response = MagicMock()
+    mock_response.json.return_value = dict(fields, response=text)
+    mock_response.raise_for_status.return_value = None
+    return mock_response
+
+
+@pytest.fixture
+def code_block():
+    """Factory for a model answer in the format the prompt asks for, with `code` as the modified code"""
+    return make_code_block
+
+
+@pytest.fixture
+def ollama_response():
+    """Factory for a mocked requests.post response from Ollama's /api/generate"""
+    return make_ollama_response
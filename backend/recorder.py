@@ -0,0 +1,85 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Optional, Dict, Any, Iterator
+
+# Every log starts with this header so the reader can reject foreign files
+LOG_MAGIC = b"CITRAFFIC1\n"
+# Each record is framed as <payload length, crc32 of payload> followed by the zlib payload
+FRAME_HEADER = struct.Struct("<II")
+
+
+class TrafficRecorder:
+    """Append-only, zlib-compressed log of prompts and raw provider responses"""
+
+    def __init__(self, path: str, compression_level: int = 6):
+        self.path = path
+        self.compression_level = compression_level
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        # Write the header once for a fresh log, never rewrite an existing one
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "wb") as f:
+                f.write(LOG_MAGIC)
+
+    @classmethod
+    def from_env(cls) -> Optional["TrafficRecorder"]:
+        """Create a recorder if RECORD_TRAFFIC is enabled, otherwise return None"""
+        if os.getenv("RECORD_TRAFFIC", "False").lower() not in ["true", "1", "yes"]:
+            return None
+        path = os.getenv("TRAFFIC_LOG_PATH", "traffic.log")
+        print(f"Recording traffic to {path}")
+        return cls(path)
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        """Append a single record to the log"""
+        entry = dict(entry)
+        entry.setdefault("recorded_at", time.time())
+        payload = zlib.compress(
+            json.dumps(entry, separators=(",", ":")).encode("utf-8"),
+            self.compression_level,
+        )
+        frame = FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        # A single write per frame keeps concurrent appends from interleaving
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(frame)
+
+
+def read_traffic_log(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate over the records of a traffic log through a memory map.
+    A truncated or corrupt trailing frame (e.g. from a crash mid-write) ends iteration.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size <= len(LOG_MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(LOG_MAGIC)] != LOG_MAGIC:
+                raise ValueError(f"{path} is not a traffic log")
+
+            offset = len(LOG_MAGIC)
+            size = len(mm)
+            while offset + FRAME_HEADER.size <= size:
+                length, checksum = FRAME_HEADER.unpack_from(mm, offset)
+                start = offset + FRAME_HEADER.size
+                end = start + length
+                if end > size:
+                    print(f"Truncated record at offset {offset}, stopping")
+                    return
+
+                payload = mm[start:end]
+                if zlib.crc32(payload) != checksum:
+                    print(f"Corrupt record at offset {offset}, stopping")
+                    return
+
+                yield json.loads(zlib.decompress(payload))
+                offset = end
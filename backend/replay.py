@@ -0,0 +1,191 @@
+"""
+Replay a recorded traffic log (see recorder.py) for offline regression and perf testing.
+
+Usage:
+    python replay.py traffic.log                 # re-run extraction on every recorded response
+    python replay.py traffic.log --pipeline      # run the whole /iterate-code pipeline against a stub server
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List
+
+from recorder import read_traffic_log
+
+
+class StubProviderServer:
+    """Local HTTP server that answers Ollama and Groq calls with a recorded response"""
+
+    def __init__(self):
+        self.response_text = ""
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                # Drain the request body so the client never sees a reset connection
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.startswith("/api/generate"):
+                    body = {"response": stub.response_text}
+                else:
+                    body = {"choices": [{"message": {"role": "assistant", "content": stub.response_text}}]}
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def is_repair(record: Dict[str, Any]) -> bool:
+    return (record.get("outcome") or "").startswith("repair_")
+
+
+def load_records(path: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Load replayable records: those that captured a provider response to the user's request.
+    Repair attempts answer a different prompt about the broken code, so they are skipped.
+    """
+    records = []
+    for record in read_traffic_log(path):
+        if not record.get("raw_response") or is_repair(record):
+            continue
+        records.append(record)
+        if limit is not None and len(records) >= limit:
+            break
+    return records
+
+
+def replay_extraction(records: List[Dict[str, Any]], repeat: int = 1) -> List[Dict[str, Any]]:
+    """Feed each recorded response back through extract_with_strategy and time it"""
+    from app import extract_with_strategy
+
+    results = []
+    for index, record in enumerate(records):
+        request = record["request"]
+        started = time.perf_counter()
+        for _ in range(repeat):
+            modified_code, _, strategy = extract_with_strategy(
+                record["raw_response"], request.get("language", "javascript"), request["code"]
+            )
+        elapsed_ms = (time.perf_counter() - started) * 1000 / repeat
+
+        results.append({
+            "index": index,
+            "recorded_strategy": record.get("strategy"),
+            "strategy": strategy,
+            "changed": strategy != record.get("strategy"),
+            "modified": modified_code != request["code"],
+            "recorded_ms": (record.get("timings") or {}).get("extract_ms"),
+            "elapsed_ms": elapsed_ms,
+        })
+    return results
+
+
+def replay_pipeline(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Send each recorded request through /iterate-code with providers pointed at a stub server"""
+    from fastapi.testclient import TestClient
+    import app as app_module
+
+    saved = {
+        name: getattr(app_module, name)
+        for name in ["OLLAMA_API_URL", "OLLAMA_MODELS", "GROQ_API_URL", "GROQ_API_KEY", "recorder"]
+    }
+    client = TestClient(app_module.app)
+    results = []
+
+    with StubProviderServer() as stub:
+        app_module.OLLAMA_API_URL = stub.url
+        app_module.GROQ_API_URL = f"{stub.url}/openai/v1/chat/completions"
+        app_module.GROQ_API_KEY = app_module.GROQ_API_KEY or "replay"
+        # Never re-record replayed traffic into the log being replayed
+        app_module.recorder = None
+
+        try:
+            for index, record in enumerate(records):
+                stub.response_text = record["raw_response"]
+                payload = dict(record["request"])
+                payload["use_groq"] = record.get("provider") == "groq"
+                payload["response_format"] = "full"
+                # Set for every record, so a Groq record never falls back to a previous record's model
+                if record.get("provider") == "ollama":
+                    app_module.OLLAMA_MODELS = [record.get("model")]
+                else:
+                    app_module.OLLAMA_MODELS = saved["OLLAMA_MODELS"]
+
+                started = time.perf_counter()
+                response = client.post("/iterate-code", json=payload)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+
+                results.append({
+                    "index": index,
+                    "status_code": response.status_code,
+                    "recorded_outcome": record.get("outcome"),
+                    "modified": response.status_code == 200
+                    and response.json()["modified_code"] != payload["code"],
+                    "elapsed_ms": elapsed_ms,
+                })
+        finally:
+            for name, value in saved.items():
+                setattr(app_module, name, value)
+
+    return results
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Aggregate timings and counts across replayed records"""
+    timings = sorted(result["elapsed_ms"] for result in results)
+    if not timings:
+        return {"records": 0}
+    return {
+        "records": len(results),
+        "modified": sum(1 for result in results if result["modified"]),
+        "strategy_changes": sum(1 for result in results if result.get("changed")),
+        "total_ms": round(sum(timings), 3),
+        "mean_ms": round(sum(timings) / len(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "max_ms": round(timings[-1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded traffic log")
+    parser.add_argument("log", help="Path to the traffic log written with RECORD_TRAFFIC=True")
+    parser.add_argument("--pipeline", action="store_true", help="Replay the full /iterate-code pipeline against a stub server")
+    parser.add_argument("--repeat", type=int, default=1, help="Extraction runs per record, for steadier timings")
+    parser.add_argument("--limit", type=int, default=None, help="Only replay the first N records")
+    parser.add_argument("--verbose", action="store_true", help="Print one line per record")
+    args = parser.parse_args()
+
+    records = load_records(args.log, args.limit)
+    print(f"Loaded {len(records)} replayable records from {args.log}")
+
+    if args.pipeline:
+        results = replay_pipeline(records)
+    else:
+        results = replay_extraction(records, max(1, args.repeat))
+
+    if args.verbose:
+        for result in results:
+            print(json.dumps(result))
+    print(json.dumps(summarize(results), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import random
+import threading
+from typing import Optional, Dict, Any, List, Tuple, Iterable
+from validation import LANGUAGE_ALIASES
+
+# Upper bounds (in characters of submitted code) of the size buckets
+SIZE_BUCKETS = [(1000, "small"), (10000, "medium"), (100000, "large")]
+
+# Extraction strategies that count as a successful parse
+PARSED_STRATEGIES = {"markers", "code_block", "python_separator", "raw_code"}
+
+# Latency assumed for a target that has never returned a response
+DEFAULT_LATENCY_MS = 10000.0
+
+Target = Tuple[str, str]  # (provider, model)
+
+
+def language_key(language: str) -> str:
+    """
+    Canonical language name for the statistics key. Languages are client-supplied,
+    so unknown ones share a single "other" key and cannot grow the table.
+    """
+    language = (language or "").lower()
+    return language if language in LANGUAGE_ALIASES else "other"
+
+
+def size_bucket(code_length: int) -> str:
+    for limit, name in SIZE_BUCKETS:
+        if code_length < limit:
+            return name
+    return "huge"
+
+
+class RouteStats:
+    """Exponentially weighted statistics for one (provider, model, language, size bucket)"""
+
+    def __init__(self):
+        self.attempts = 0
+        self.latency_ms: Optional[float] = None
+        self.success_rate = 0.0
+        self.parse_rate = 0.0
+        self.unchanged_rate = 0.0
+        self.error_rate = 0.0
+
+    def observe(self, outcome: str, strategy: Optional[str], latency_ms: Optional[float], decay: float) -> None:
+        self.attempts += 1
+        # Use a plain running mean until there are enough samples for the decay to take over
+        weight = max(decay, 1.0 / self.attempts)
+
+        def blend(current, value):
+            return current + weight * (value - current)
+
+        self.success_rate = blend(self.success_rate, 1.0 if outcome == "ok" else 0.0)
+        self.parse_rate = blend(self.parse_rate, 1.0 if strategy in PARSED_STRATEGIES else 0.0)
+        self.unchanged_rate = blend(self.unchanged_rate, 1.0 if outcome == "unchanged" else 0.0)
+        self.error_rate = blend(self.error_rate, 1.0 if outcome in ("error", "empty") else 0.0)
+        if latency_ms is not None:
+            self.latency_ms = latency_ms if self.latency_ms is None else blend(self.latency_ms, latency_ms)
+
+    def expected_cost_ms(self) -> float:
+        """
+        Expected time until a usable result if this target is tried first (lower is better).
+        latency_ms averages every attempt, so failures (e.g. timeouts) are charged the time they took.
+        """
+        # Laplace smoothing keeps a couple of failures from ruling a target out forever
+        successes = self.success_rate * self.attempts
+        success_rate = (successes + 1.0) / (self.attempts + 2.0)
+        latency = self.latency_ms if self.latency_ms is not None else DEFAULT_LATENCY_MS
+        return latency / success_rate
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "attempts": self.attempts,
+            "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "success_rate": round(self.success_rate, 3),
+            "parse_rate": round(self.parse_rate, 3),
+            "unchanged_rate": round(self.unchanged_rate, 3),
+            "error_rate": round(self.error_rate, 3),
+            "expected_cost_ms": round(self.expected_cost_ms(), 1),
+        }
+
+
+class Router:
+    """Orders providers per request by their recorded latency and success for similar requests"""
+
+    def __init__(self, exploration_rate: float = 0.1, decay: float = 0.1, min_attempts: int = 3, seed: Optional[int] = None):
+        self.exploration_rate = exploration_rate
+        self.decay = decay
+        # Targets with fewer attempts than this for a bucket keep their configured position
+        self.min_attempts = min_attempts
+        self._stats: Dict[Tuple[str, str, str, str], RouteStats] = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def observe(self, provider: str, model: str, language: str, code_length: int,
+                outcome: str, strategy: Optional[str] = None, latency_ms: Optional[float] = None) -> None:
+        """Record the outcome of one provider attempt"""
+        key = (provider, model, language_key(language), size_bucket(code_length))
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = RouteStats()
+            stats.observe(outcome, strategy, latency_ms, self.decay)
+
+    def order(self, targets: List[Target], language: str, code_length: int, pinned: int = 0) -> List[Target]:
+        """
+        Reorder targets best first. The first `pinned` targets keep their position.
+        Targets without enough data keep their configured order, after the ones that have proven themselves.
+        With probability exploration_rate a random target is moved to the front, so rankings keep getting refreshed.
+        """
+        head, rest = list(targets[:pinned]), list(targets[pinned:])
+        if len(rest) < 2:
+            return head + rest
+
+        bucket = size_bucket(code_length)
+        language = language_key(language)
+        with self._lock:
+            stats = [self._stats.get((provider, model, language, bucket)) for provider, model in rest]
+
+        known = [
+            (stat.expected_cost_ms(), index)
+            for index, stat in enumerate(stats)
+            if stat is not None and stat.attempts >= self.min_attempts
+        ]
+        known_indexes = {index for _, index in known}
+        ordered = [rest[index] for _, index in sorted(known)]
+        ordered += [target for index, target in enumerate(rest) if index not in known_indexes]
+
+        if self._random.random() < self.exploration_rate:
+            explored = ordered.pop(self._random.randrange(len(ordered)))
+            ordered.insert(0, explored)
+
+        return head + ordered
+
+    def seed_from_records(self, records: Iterable[Dict[str, Any]]) -> int:
+        """Replay recorded attempts (see recorder.py) into the statistics, returns the number used"""
+        count = 0
+        for record in records:
+            outcome = record.get("outcome")
+            request = record.get("request") or {}
+            if not outcome or outcome.startswith("repair_") or not record.get("provider"):
+                continue
+            self.observe(
+                record["provider"], record.get("model") or "", request.get("language", ""),
+                len(request.get("code", "")), outcome, record.get("strategy"),
+                (record.get("timings") or {}).get("provider_ms"),
+            )
+            count += 1
+        return count
+
+    def table(self) -> Dict[str, Any]:
+        """Routing table grouped by language and size bucket, best target first"""
+        with self._lock:
+            items = list(self._stats.items())
+        table: Dict[str, Any] = {}
+        for (provider, model, language, bucket), stats in sorted(items, key=lambda item: item[1].expected_cost_ms()):
+            entry = {"provider": provider, "model": model}
+            entry.update(stats.to_dict())
+            table.setdefault(language, {}).setdefault(bucket, []).append(entry)
+        return {
+            "exploration_rate": self.exploration_rate,
+            "decay": self.decay,
+            "min_attempts": self.min_attempts,
+            "routes": table,
+        }
@@ -0,0 +1,64 @@
+import threading
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from app import app
+from candidates import Candidate, rank_candidates
+from validation import ValidationResult
+
+client = TestClient(app)
+
+ORIGINAL_CODE = "def add(a, b):\n    return a + b"
+SMALL_CHANGE = 'def add(a, b):\n    """Add two numbers."""\n    return a + b'
+LARGE_CHANGE = 'def add(a, b):\n    """Add two numbers."""\n    result = a + b\n    print(result)\n    return result'
+BROKEN_CHANGE = 'def add(a, b:\n    """Add two numbers."""\n    return a + b'
+
+def test_rank_prefers_valid_then_smallest_diff():
+    """Test that candidates rank by modification, validity and diff size."""
+    valid = ValidationResult(ok=True)
+    invalid = ValidationResult(ok=False, error="invalid syntax")
+    ranked = rank_candidates([
+        Candidate("ollama", "unchanged", modified_code=ORIGINAL_CODE),
+        Candidate("ollama", "broken", modified_code=BROKEN_CHANGE, strategy="markers", validation=invalid),
+        Candidate("ollama", "large", modified_code=LARGE_CHANGE, strategy="markers", validation=valid),
+        Candidate("ollama", "small", modified_code=SMALL_CHANGE, strategy="markers", validation=valid),
+        Candidate("ollama", "failed", error="Connection error"),
+    ], ORIGINAL_CODE)
+    assert [candidate.model for candidate in ranked[:3]] == ["small", "large", "broken"]
+    assert ranked[0].diff_lines < ranked[1].diff_lines
+
+@patch("requests.post")
+def test_multiple_candidates_return_best(mock_post, ollama_response, code_block):
+    """Test that several candidates are generated in one request and the best is returned."""
+    responses = iter([BROKEN_CHANGE, LARGE_CHANGE, SMALL_CHANGE])
+    lock = threading.Lock()
+
+    def respond(*args, **kwargs):
+        with lock:
+            code = next(responses)
+        return ollama_response(code_block(code))
+
+    mock_post.side_effect = respond
+
+    response = client.post("/iterate-code", json={
+        "code": ORIGINAL_CODE,
+        "instruction": "Add a docstring",
+        "language": "python",
+        "use_groq": False,
+        "candidates": 3,
+        "include_candidates": True,
+    })
+
+    assert response.status_code == 200
+    assert mock_post.call_count == 3
+    body = response.json()
+    assert body["modified_code"] == SMALL_CHANGE
+    assert [candidate["valid"] for candidate in body["candidates"]] == [True, False]
+
+def test_candidates_out_of_range():
+    """Test that the number of candidates is bounded."""
+    response = client.post("/iterate-code", json={
+        "code": ORIGINAL_CODE,
+        "instruction": "Add a docstring",
+        "candidates": 0,
+    })
+    assert response.status_code == 400
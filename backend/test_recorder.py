@@ -0,0 +1,115 @@
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+import app as app_module
+from recorder import TrafficRecorder, read_traffic_log
+from replay import load_records, replay_extraction, replay_pipeline, summarize
+
+SAMPLE_RESPONSE = """
+EXPLANATION:
+Added a docstring.
+
+MODIFIED CODE:
+```python
+def add(a, b):
+    \"\"\"Add two numbers.\"\"\"
+    return a + b
+```
+"""
+
+def make_record(**overrides):
+    record = {
+        "request": {"code": "def add(a, b):\n    return a + b", "instruction": "Add a docstring", "language": "python"},
+        "prompt": "prompt",
+        "provider": "ollama",
+        "model": "codellama:latest",
+        "raw_response": SAMPLE_RESPONSE,
+        "strategy": "markers",
+        "timings": {"extract_ms": 1.0},
+        "outcome": "ok",
+    }
+    record.update(overrides)
+    return record
+
+def test_recorder_round_trip(tmp_path):
+    """Test that records written to the log are read back in order."""
+    path = str(tmp_path / "traffic.log")
+    recorder = TrafficRecorder(path)
+    recorder.record(make_record(model="first"))
+    recorder.record(make_record(model="second"))
+
+    records = list(read_traffic_log(path))
+    assert [record["model"] for record in records] == ["first", "second"]
+    assert "recorded_at" in records[0]
+
+def test_recorder_ignores_truncated_tail(tmp_path):
+    """Test that a partially written final record does not break reading."""
+    path = str(tmp_path / "traffic.log")
+    TrafficRecorder(path).record(make_record())
+    with open(path, "ab") as f:
+        f.write(b"\x10\x00\x00\x00garbage")
+
+    assert len(list(read_traffic_log(path))) == 1
+
+def test_read_rejects_foreign_file(tmp_path):
+    """Test that files without the log header are rejected."""
+    path = tmp_path / "other.log"
+    path.write_bytes(b"not a traffic log at all")
+    with pytest.raises(ValueError):
+        list(read_traffic_log(str(path)))
+
+@patch("requests.post")
+def test_iterate_code_records_attempts(mock_post, tmp_path, ollama_response):
+    """Test that /iterate-code appends an attempt when recording is enabled."""
+    mock_post.return_value = ollama_response(SAMPLE_RESPONSE)
+
+    path = str(tmp_path / "traffic.log")
+    with patch.object(app_module, "recorder", TrafficRecorder(path)):
+        response = TestClient(app_module.app).post(
+            "/iterate-code",
+            json={"code": "def add(a, b):\n    return a + b", "instruction": "Add a docstring", "language": "python", "use_groq": False}
+        )
+
+    assert response.status_code == 200
+    records = list(read_traffic_log(path))
+    assert len(records) == 1
+    assert records[0]["strategy"] == "markers"
+    assert records[0]["outcome"] == "ok"
+    assert records[0]["raw_response"] == SAMPLE_RESPONSE
+    assert "provider_ms" in records[0]["timings"]
+
+def test_replay_extraction_and_pipeline(tmp_path):
+    """Test that recorded responses replay through extraction and the full pipeline."""
+    path = str(tmp_path / "traffic.log")
+    recorder = TrafficRecorder(path)
+    recorder.record(make_record())
+    recorder.record(make_record(raw_response=None, outcome="error"))
+    recorder.record(make_record(outcome="repair_ok"))
+
+    records = load_records(path)
+    assert len(records) == 1
+
+    extraction = replay_extraction(records)
+    assert extraction[0]["strategy"] == "markers"
+    assert not extraction[0]["changed"]
+
+    pipeline = replay_pipeline(records)
+    assert pipeline[0]["status_code"] == 200
+    assert pipeline[0]["modified"]
+    assert summarize(pipeline)["records"] == 1
+
+def test_replay_pipeline_resets_ollama_models_per_record():
+    """Test that a Groq record replayed after an Ollama record sees the configured Ollama models."""
+    seen = []
+    original_generate = app_module.generate_with_provider
+
+    def spy(provider, model, prompt):
+        seen.append((provider, list(app_module.OLLAMA_MODELS)))
+        return original_generate(provider, model, prompt)
+
+    with patch.object(app_module, "generate_with_provider", spy):
+        replay_pipeline([make_record(), make_record(provider="groq", model="llama")])
+
+    assert seen[0] == ("ollama", ["codellama:latest"])
+    assert seen[1][0] == "groq"
+    assert seen[1][1] == app_module.OLLAMA_MODELS
@@ -0,0 +1,99 @@
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+import app as app_module
+from routing import Router, size_bucket, language_key
+
+client = TestClient(app_module.app)
+
+TARGETS = [("ollama", "slow"), ("ollama", "flaky"), ("ollama", "fast")]
+
+def train(router, model, outcome, latency_ms, times=5, language="python", code_length=500):
+    for _ in range(times):
+        router.observe("ollama", model, language, code_length, outcome, "markers", latency_ms)
+
+def test_size_bucket():
+    """Test that code sizes map to buckets."""
+    assert size_bucket(10) == "small"
+    assert size_bucket(5000) == "medium"
+    assert size_bucket(10 ** 6) == "huge"
+
+def test_order_prefers_fast_successful_models():
+    """Test that targets are ordered by latency weighted by success rate."""
+    router = Router(exploration_rate=0.0)
+    train(router, "slow", "ok", 20000)
+    train(router, "flaky", "unchanged", 1000)
+    train(router, "fast", "ok", 2000)
+    assert router.order(TARGETS, "python", 500) == [("ollama", "fast"), ("ollama", "flaky"), ("ollama", "slow")]
+
+def test_slow_failures_are_charged_their_time():
+    """Test that a model which often times out ranks behind a slower but reliable one."""
+    router = Router(exploration_rate=0.0)
+    for _ in range(10):
+        router.observe("ollama", "flaky", "python", 500, "ok", "markers", 2000)
+        router.observe("ollama", "flaky", "python", 500, "error", None, 120000)
+        router.observe("ollama", "slow", "python", 500, "ok", "markers", 10000)
+    assert router.order(TARGETS, "python", 500)[0] == ("ollama", "slow")
+
+@patch("requests.post")
+def test_failed_attempts_record_elapsed_time(mock_post):
+    """Test that error attempts pass their elapsed time to the router."""
+    mock_post.side_effect = app_module.requests.Timeout("timed out")
+    with patch.object(app_module.router, "observe") as observe:
+        client.post("/iterate-code", json={"code": "x = 1", "instruction": "Rename x", "language": "python", "use_groq": False})
+    assert observe.call_count == len(app_module.OLLAMA_MODELS)
+    assert all(call.args[5] is None and call.args[6] is not None for call in observe.call_args_list)
+
+def test_order_is_per_language_and_size():
+    """Test that statistics for one language or size do not affect another."""
+    router = Router(exploration_rate=0.0)
+    train(router, "fast", "ok", 100)
+    assert router.order(TARGETS, "javascript", 500) == TARGETS
+    assert router.order(TARGETS, "python", 50000) == TARGETS
+
+def test_order_keeps_pinned_and_unknown_targets():
+    """Test that pinned targets stay first and unproven targets keep their configured order."""
+    router = Router(exploration_rate=0.0)
+    train(router, "fast", "ok", 100)
+    train(router, "slow", "ok", 100000, times=1)
+    assert router.order(TARGETS, "python", 500, pinned=1) == [("ollama", "slow"), ("ollama", "fast"), ("ollama", "flaky")]
+
+def test_unknown_languages_share_one_key():
+    """Test that arbitrary client-supplied languages cannot grow the routing table."""
+    assert language_key("Python") == "python"
+    assert language_key(None) == "other"
+    router = Router(exploration_rate=0.0)
+    for i in range(100):
+        router.observe("ollama", "fast", f"made-up-{i}", 500, "ok", "markers", 100)
+    routes = router.table()["routes"]
+    assert list(routes) == ["other"]
+    assert routes["other"]["small"][0]["attempts"] == 100
+
+def test_exploration_moves_a_random_target_first():
+    """Test that exploration sometimes tries a target other than the best one."""
+    router = Router(exploration_rate=1.0, seed=1)
+    train(router, "fast", "ok", 100)
+    firsts = {router.order(TARGETS, "python", 500)[0] for _ in range(50)}
+    assert len(firsts) > 1
+
+def test_seed_from_records():
+    """Test that recorded attempts seed the routing table, skipping repairs."""
+    router = Router()
+    used = router.seed_from_records([
+        {"provider": "groq", "model": "m", "outcome": "ok", "strategy": "markers",
+         "timings": {"provider_ms": 500}, "request": {"language": "python", "code": "x = 1"}},
+        {"provider": "groq", "model": "m", "outcome": "repair_ok", "request": {"language": "python", "code": "x = 1"}},
+    ])
+    assert used == 1
+    route = router.table()["routes"]["python"]["small"][0]
+    assert route["attempts"] == 1
+    assert route["latency_ms"] == 500
+
+def test_admin_routing_endpoint():
+    """Test that the routing table is exposed and honours the admin token."""
+    with patch.object(app_module, "ADMIN_TOKEN", None):
+        response = client.get("/admin/routing")
+        assert response.status_code == 200
+        assert "routes" in response.json()
+    with patch.object(app_module, "ADMIN_TOKEN", "secret"):
+        assert client.get("/admin/routing").status_code == 403
+        assert client.get("/admin/routing", headers={"X-Admin-Token": "secret"}).status_code == 200
@@ -0,0 +1,152 @@
+import json
+import os
+import threading
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+import app as app_module
+from tracing import Trace, current_trace, span, add_completed_span, export_trace, parse_trace_mode, prune_traces
+
+client = TestClient(app_module.app)
+
+REQUEST = {"code": "def add(a, b):\n    return a + b", "instruction": "Add a docstring", "language": "python", "use_groq": False}
+
+SAMPLE_RESPONSE = (
+    "EXPLANATION:\nAdded a docstring.\n\nMODIFIED CODE:\n"
+    "```python\ndef add(a, b):\n    \"\"\"Add two numbers.\"\"\"\n    return a + b\n```"
+)
+
+# Phase timings Ollama reports alongside the response, in nanoseconds
+OLLAMA_TIMINGS = {
+    "load_duration": 2_000_000,
+    "prompt_eval_duration": 3_000_000,
+    "eval_duration": 5_000_000,
+    "total_duration": 11_000_000,
+}
+
+def read_trace_files(directory):
+    names = sorted(os.listdir(directory))
+    return names, [json.load(open(os.path.join(directory, name))) for name in names if name.endswith(".json")]
+
+def test_parse_trace_mode():
+    """Test that header and query values map to tracing modes."""
+    assert parse_trace_mode(None) is None
+    assert parse_trace_mode("0") is None
+    assert parse_trace_mode("1") == "trace"
+    assert parse_trace_mode("Profile") == "profile"
+
+def test_span_is_noop_without_trace():
+    """Test that spans cost nothing and record nothing outside a traced request."""
+    with span("work") as current:
+        current.set(ignored=True)
+    add_completed_span("external", 5.0)
+
+def untraced_work():
+    with span("other"):
+        pass
+
+def test_spans_nest_and_export(tmp_path):
+    """Test that nested spans get parents and both export formats are written."""
+    trace = Trace("request")
+    token = current_trace.set(trace)
+    try:
+        with span("outer"):
+            with span("inner", size=3):
+                pass
+            add_completed_span("queued", 2.5)
+            # Worker threads without a copied context do not see the trace
+            thread = threading.Thread(target=untraced_work)
+            thread.start()
+            thread.join()
+    finally:
+        current_trace.reset(token)
+    trace.finish()
+
+    spans = {span.name: span for span in trace.spans}
+    assert set(spans) == {"request", "outer", "inner", "queued"}
+    assert spans["inner"].parent_id == spans["outer"].span_id
+    assert spans["queued"].parent_id == spans["outer"].span_id
+    assert spans["outer"].parent_id == trace.root.span_id
+
+    chrome = json.load(open(export_trace(trace, str(tmp_path / "chrome"))))
+    events = {event["name"]: event for event in chrome["traceEvents"]}
+    assert events["inner"]["ph"] == "X"
+    assert events["inner"]["args"] == {"size": 3}
+    assert abs(events["queued"]["dur"] - 2500) < 1
+
+    otlp = json.load(open(export_trace(trace, str(tmp_path / "otlp"), "otlp")))
+    otlp_spans = otlp["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert len(otlp_spans) == 4
+    assert all(len(entry["traceId"]) == 32 and len(entry["spanId"]) == 16 for entry in otlp_spans)
+
+@patch("requests.post")
+def test_iterate_code_writes_requested_trace(mock_post, tmp_path, ollama_response):
+    """Test that X-Trace writes a trace with provider, extraction and validation spans."""
+    mock_post.return_value = ollama_response(SAMPLE_RESPONSE, **OLLAMA_TIMINGS)
+    with patch.object(app_module, "TRACE_DIR", str(tmp_path)), patch.object(app_module, "ADMIN_TOKEN", None):
+        response = client.post("/iterate-code", json=REQUEST, headers={"X-Trace": "1"})
+
+    assert response.status_code == 200
+    assert "X-Trace-Id" in response.headers
+    _, traces = read_trace_files(tmp_path)
+    assert len(traces) == 1
+    events = {event["name"]: event for event in traces[0]["traceEvents"]}
+    for name in ["iterate-code", "build_prompt", "provider", "ollama.load_model", "ollama.eval", "extract", "validate"]:
+        assert name in events
+    assert events["extract"]["args"]["strategy"] == "markers"
+    assert events["provider"]["args"]["server_ms"] == 11.0
+    assert events["iterate-code"]["args"]["status_code"] == 200
+
+@patch("requests.post")
+def test_iterate_code_profile_and_slow_sampling(mock_post, tmp_path, ollama_response):
+    """Test profiling on request, slow-request sampling, and that untraced fast requests write nothing."""
+    mock_post.return_value = ollama_response(SAMPLE_RESPONSE, **OLLAMA_TIMINGS)
+    with patch.object(app_module, "TRACE_DIR", str(tmp_path)), patch.object(app_module, "ADMIN_TOKEN", None):
+        assert client.post("/iterate-code?trace=profile", json=REQUEST).status_code == 200
+        names, _ = read_trace_files(tmp_path)
+        assert len(names) == 2
+        assert any(name.endswith((".prof", ".html")) for name in names)
+
+        with patch.object(app_module, "TRACE_SLOW_MS", 60_000):
+            client.post("/iterate-code", json=REQUEST)
+        assert len(os.listdir(tmp_path)) == 2
+
+        with patch.object(app_module, "TRACE_SLOW_MS", 0.001):
+            client.post("/iterate-code", json=REQUEST)
+        _, traces = read_trace_files(tmp_path)
+        assert len(traces) == 2
+        assert any(trace["traceEvents"][0]["args"]["sampled"] for trace in traces)
+
+def test_trace_requires_admin_token():
+    """Test that tracing is refused without the admin token when one is configured."""
+    with patch.object(app_module, "ADMIN_TOKEN", "secret"):
+        assert client.post("/iterate-code", json=REQUEST, headers={"X-Trace": "1"}).status_code == 403
+
+@patch("requests.post")
+def test_trace_id_on_errors_and_profiler_failure(mock_post, tmp_path):
+    """Test that failed requests still carry the trace id and a profiler that cannot start is skipped."""
+    mock_post.side_effect = app_module.requests.RequestException("connection refused")
+    with patch.object(app_module, "TRACE_DIR", str(tmp_path)), patch.object(app_module, "ADMIN_TOKEN", None), \
+            patch.object(app_module.RequestProfiler, "start", side_effect=ValueError("Another profiling tool is already active")):
+        response = client.post("/iterate-code", json=REQUEST, headers={"X-Trace": "profile"})
+
+    assert response.status_code == 503
+    assert "X-Trace-Id" in response.headers
+    names, traces = read_trace_files(tmp_path)
+    assert names == [name for name in names if name.endswith(".json")]
+    assert traces[0]["traceEvents"][0]["args"]["status_code"] == 503
+
+def test_prune_traces_keeps_newest(tmp_path):
+    """Test that exporting with max_files deletes the oldest traces and their profiles."""
+    for i in range(5):
+        base = tmp_path / f"2026010{i + 1}-120000-{i:012x}"
+        (tmp_path / (base.name + ".json")).write_text("{}")
+        (tmp_path / (base.name + ".prof")).write_text("")
+    (tmp_path / "notes.txt").write_text("kept")
+
+    assert prune_traces(str(tmp_path), 2) == 6
+    names = sorted(os.listdir(tmp_path))
+    assert names == ["20260104-120000-000000000003.json", "20260104-120000-000000000003.prof",
+                     "20260105-120000-000000000004.json", "20260105-120000-000000000004.prof", "notes.txt"]
+
+    export_trace(Trace("request"), str(tmp_path), max_files=2)
+    assert len([name for name in os.listdir(tmp_path) if name.endswith(".json")]) == 2
@@ -0,0 +1,134 @@
+import gzip
+import json
+import os
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from app import app
+from transport import ContextStore, RequestDecompressionMiddleware, make_patch, apply_patch, content_hash
+
+client = TestClient(app)
+
+FULL_FILE = "\n".join(f"def function_{i}():\n    return {i}\n" for i in range(200))
+SNIPPET = "def add(a, b):\n    return a + b"
+MODIFIED_SNIPPET = 'def add(a, b):\n    """Add two numbers."""\n    return a + b'
+
+@pytest.mark.parametrize("original,modified", [
+    ("a\nb\nc", "a\nB\nc"),
+    ("a\nb\nc", "x\na\nc\ny"),
+    ("", "new"),
+    ("same", "same"),
+])
+def test_patch_round_trip(original, modified):
+    """Test that applying a patch reproduces the modified code."""
+    assert apply_patch(original, make_patch(original, modified)) == modified
+
+def test_context_store_evicts_least_recently_used():
+    """Test that the context store stays within its size budget."""
+    store = ContextStore(max_bytes=10)
+    first = store.put("aaaa")
+    second = store.put("bbbb")
+    store.get(first)
+    store.put("cccc")
+    assert store.get(first) == "aaaa"
+    assert store.get(second) is None
+    with pytest.raises(ValueError):
+        store.put("x" * 11)
+
+@patch("requests.post")
+def test_full_context_by_hash(mock_post, ollama_response, code_block):
+    """Test that an uploaded context can be referenced by hash in a selection request."""
+    mock_post.return_value = ollama_response(code_block(MODIFIED_SNIPPET))
+
+    upload = client.post("/contexts", json={"content": FULL_FILE})
+    assert upload.status_code == 200
+    assert upload.json()["hash"] == content_hash(FULL_FILE)
+
+    response = client.post("/iterate-code", json={
+        "code": SNIPPET,
+        "instruction": "Add a docstring",
+        "language": "python",
+        "selection": {"start_line": 1, "end_line": 2},
+        "full_context_hash": upload.json()["hash"],
+        "use_groq": False,
+    })
+    assert response.status_code == 200
+    assert "def function_199" in mock_post.call_args.kwargs["json"]["prompt"]
+
+def test_unknown_context_hash_returns_conflict():
+    """Test that referencing a missing context asks the client to upload it."""
+    response = client.post("/iterate-code", json={
+        "code": SNIPPET,
+        "instruction": "Add a docstring",
+        "selection": {"start_line": 1, "end_line": 2},
+        "full_context_hash": "0" * 64,
+    })
+    assert response.status_code == 409
+
+@patch("requests.post")
+def test_patch_response(mock_post, ollama_response, code_block):
+    """Test that a patch response reconstructs the modified code."""
+    original = "\n".join(f"value_{i} = {i}" for i in range(100))
+    modified = original.replace("value_50 = 50", "value_50 = 500")
+    mock_post.return_value = ollama_response(code_block(modified))
+
+    response = client.post("/iterate-code", json={
+        "code": original,
+        "instruction": "Change value_50",
+        "language": "python",
+        "use_groq": False,
+        "response_format": "patch",
+    })
+    assert response.status_code == 200
+    body = response.json()
+    assert "modified_code" not in body
+    assert apply_patch(original, body["patch"]) == modified
+
+@patch("requests.post")
+def test_gzip_request_and_response(mock_post, ollama_response, code_block):
+    """Test that gzip request bodies are accepted and large responses are compressed."""
+    mock_post.return_value = ollama_response(code_block(FULL_FILE.replace("return 7\n", "return 70\n")))
+    payload = json.dumps({
+        "code": FULL_FILE,
+        "instruction": "Change function_7",
+        "language": "python",
+        "use_groq": False,
+    }).encode("utf-8")
+
+    response = client.post(
+        "/iterate-code",
+        content=gzip.compress(payload),
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip", "Accept-Encoding": "gzip"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] in ("gzip", "br")
+    assert "return 70" in response.json()["modified_code"]
+
+def test_unsupported_request_encoding():
+    """Test that request encodings other than gzip are rejected."""
+    response = client.post(
+        "/iterate-code",
+        content=b"whatever",
+        headers={"Content-Type": "application/json", "Content-Encoding": "compress"},
+    )
+    assert response.status_code == 415
+
+def test_truncated_and_oversized_gzip_bodies():
+    """Test that truncated gzip streams are rejected and compressed bodies are capped too."""
+    payload = gzip.compress(json.dumps({"code": "x", "instruction": "y"}).encode("utf-8"))
+    response = client.post(
+        "/iterate-code",
+        content=payload[:len(payload) // 2],
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 400
+
+    small_app = FastAPI()
+    small_app.add_middleware(RequestDecompressionMiddleware, max_size=64)
+    small_app.post("/echo")(lambda: {})
+    # Incompressible data keeps the gzip stream above the limit
+    response = TestClient(small_app).post(
+        "/echo", content=gzip.compress(os.urandom(256)), headers={"Content-Encoding": "gzip"}
+    )
+    assert response.status_code == 413
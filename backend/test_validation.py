@@ -0,0 +1,133 @@
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from app import app
+import validation
+from validation import validate_code, check_balanced_brackets, register_validator, LANGUAGE_ALIASES, VALIDATORS
+
+client = TestClient(app)
+
+ORIGINAL_CODE = "def add(a, b):\n    return a + b"
+
+def test_validate_python():
+    """Test that Python output is checked with ast, including indented snippets."""
+    assert validate_code("    def f(self):\n        return 1\n", "python").ok
+    result = validate_code("def f(:\n    pass", "python")
+    assert not result.ok
+    assert result.validator == "python"
+
+def test_validation_skipped_when_original_is_invalid():
+    """Test that partial selections are not rejected for errors they already had."""
+    assert validate_code("else:\n    return 2", "python", original_code="else:\n    return 1").ok
+
+def test_original_check_cache_is_bounded():
+    """Test that only digests of a bounded number of original files are cached."""
+    for i in range(100):
+        validate_code("x = 2", "python", original_code=f"x = {i}")
+    assert len(validation._original_checks) <= validation.ORIGINAL_CHECK_CACHE_SIZE
+    assert all(isinstance(digest, bytes) for _, digest in validation._original_checks)
+
+def test_unknown_language_is_not_validated():
+    """Test that languages without a validator always pass."""
+    result = validate_code("anything(", "cobol")
+    assert result.ok
+    assert result.validator is None
+
+@pytest.mark.parametrize("code,valid", [
+    ("function f(a) { return `x${a + `y${b}`}z`.replace(/[}/]/g, '}'); }", True),
+    ("const half = total / 2 / count;", True),
+    ("const s = \"}\"; // }\n/* ( */ run()", True),
+    ("function f(s) { return /\\(/.test(s); }", True),
+    ("switch (c) { case /[)]/.source: throw /}/; }", True),
+    ("const ratio = width / height; const scaled = (a + b) / 2;", True),
+    ("const List = () => { return <ul>{items.map(i => <li key={i}>{i}</li>)}</ul>; };", True),
+    ("const Icon = () => <svg><path d=\"M0 0\" /></svg>;", True),
+    ("function f(a) { if (a) { return 1; }", False),
+    ("const s = `unterminated", False),
+])
+def test_check_balanced_brackets_javascript(code, valid):
+    """Test the bracket checker on JavaScript strings, comments, templates and regexes."""
+    assert (check_balanced_brackets(code, javascript=True) is None) == valid
+
+@pytest.mark.parametrize("code,language", [
+    ("function f(s: string): boolean { return /\\(/.test(s); }", "typescript"),
+    ("const t = `${a}{`;", "tsx"),
+    ("fn open<'a>(s: &'a str) -> char { if s.is_empty() { '{' } else { '\\u{7B}' } }", "rust"),
+    ('fn f() { let s = r#"{ "x" "#; let t = "multi\n{ line"; }', "rust"),
+    ('func f() string { return `{\n[` }', "go"),
+    (".hero { background: url(http://example.com/a.png); } /* ( */", "css"),
+    (".hero { // nested (\n  color: red; }", "scss"),
+])
+def test_bracket_checker_accepts_valid_code(code, language):
+    """Test that regexes, template literals, char literals and raw strings do not count as brackets."""
+    result = validate_code(code, language)
+    assert result.ok, result.error
+
+def test_bracket_checker_failures_are_heuristic():
+    """Test that bracket-check failures are marked as heuristic while parser failures are not."""
+    assert validate_code("fn f() { let x = 1;", "rust").heuristic
+    assert not validate_code("def f(:", "python").heuristic
+
+def test_register_validator():
+    """Test that custom validators can be plugged in for new languages."""
+    register_validator("yaml", lambda code: None if ":" in code else "not a mapping", "yml")
+    try:
+        assert validate_code("key: value", "yml").ok
+        assert not validate_code("just text", "yaml").ok
+    finally:
+        VALIDATORS.pop("yaml")
+        LANGUAGE_ALIASES.pop("yaml")
+        LANGUAGE_ALIASES.pop("yml")
+
+@patch("requests.post")
+def test_invalid_output_triggers_repair_retry(mock_post, ollama_response, code_block):
+    """Test that code failing validation is sent back to the same model once."""
+    mock_post.side_effect = [
+        ollama_response(code_block('def add(a, b):\n    """Add two numbers."""\n    return (a + b')),
+        ollama_response(code_block('def add(a, b):\n    """Add two numbers."""\n    return a + b')),
+    ]
+
+    response = client.post(
+        "/iterate-code",
+        json={"code": ORIGINAL_CODE, "instruction": "Add a docstring", "language": "python", "use_groq": False}
+    )
+
+    assert response.status_code == 200
+    assert "return a + b" in response.json()["modified_code"]
+    assert mock_post.call_count == 2
+    assert "CODE WITH ERROR" in mock_post.call_args_list[1].kwargs["json"]["prompt"]
+
+@patch("requests.post")
+def test_invalid_output_returned_with_warning_when_nothing_validates(mock_post, ollama_response, code_block):
+    """Test that broken output is still returned, with a warning, if no model fixes it."""
+    mock_post.return_value = ollama_response(code_block("def add(a, b:\n    return a + b"))
+
+    response = client.post(
+        "/iterate-code",
+        json={"code": ORIGINAL_CODE, "instruction": "Add a docstring", "language": "python", "use_groq": False}
+    )
+
+    assert response.status_code == 200
+    assert "may contain a syntax error" in response.json()["explanation"]
+
+def test_metrics_reports_validation():
+    """Test that validation counters are exposed."""
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "checked" in response.json()["validation"]
+
+@patch("requests.post")
+def test_heuristic_failure_warns_without_retrying(mock_post, ollama_response):
+    """Test that a bracket-check failure is returned with a warning, without repair or other providers."""
+    mock_post.return_value = ollama_response(
+        "EXPLANATION:\nAdded a check.\n\nMODIFIED CODE:\n```typescript\nfunction f(s: string) {\n  if (s) {\n    return 1;\n}\n```"
+    )
+
+    response = client.post(
+        "/iterate-code",
+        json={"code": "function f(s: string) {\n  return 1;\n}", "instruction": "Add a check", "language": "typescript", "use_groq": False}
+    )
+
+    assert response.status_code == 200
+    assert "may contain a syntax error" in response.json()["explanation"]
+    assert mock_post.call_count == 1
@@ -0,0 +1,240 @@
+import contextvars
+import cProfile
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List
+
+# Optional sampling profiler - cProfile is used when it is not installed
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:
+    PyinstrumentProfiler = None
+
+# The trace of the request being handled, None when tracing is off
+current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+# Id of the innermost open span, used as the parent of new spans
+current_span_id: contextvars.ContextVar = contextvars.ContextVar("current_span_id", default=None)
+
+
+class Span:
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.thread_id = threading.get_ident()
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+
+class _NullSpan:
+    """Stand-in returned by span() when the request is not traced"""
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """Spans collected for one request"""
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+        self.root = Span(self, name, None, dict(attributes or {}))
+        self.spans.append(self.root)
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def add_completed(self, name: str, duration_ms: float, start_ns: Optional[int] = None, **attributes) -> None:
+        """Add a span whose timing was measured elsewhere (e.g. reported by a provider), ending now by default"""
+        span = Span(self, name, current_span_id.get() or self.root.span_id, attributes)
+        if start_ns is None:
+            start_ns = time.time_ns() - int(duration_ms * 1e6)
+        span.start_ns = start_ns
+        span.end_ns = start_ns + int(duration_ms * 1e6)
+        self.add(span)
+
+    def finish(self) -> None:
+        self.root.end_ns = time.time_ns()
+
+    def to_chrome(self) -> Dict[str, Any]:
+        """Chrome trace-event JSON, viewable in chrome://tracing or Perfetto"""
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            events.append({
+                "name": span.name,
+                "cat": "iterate-code",
+                "ph": "X",
+                "ts": span.start_ns / 1000,
+                "dur": ((span.end_ns or span.start_ns) - span.start_ns) / 1000,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": span.attributes,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"trace_id": self.trace_id}}
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """OpenTelemetry OTLP/JSON, importable by OpenTelemetry collectors and Jaeger"""
+
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        spans = []
+        for span in self.spans:
+            entry = {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 2 if span is self.root else 1,  # SERVER for the request, INTERNAL otherwise
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns or span.start_ns),
+                "attributes": [attribute(key, value) for key, value in span.attributes.items()],
+            }
+            if span.parent_id:
+                entry["parentSpanId"] = span.parent_id
+            spans.append(entry)
+
+        return {"resourceSpans": [{
+            "resource": {"attributes": [attribute("service.name", "code-iterator-ai")]},
+            "scopeSpans": [{"scope": {"name": "code-iterator-ai"}, "spans": spans}],
+        }]}
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a block as a child of the current span. Does nothing when the request is not traced."""
+    trace = current_trace.get()
+    if trace is None:
+        yield NULL_SPAN
+        return
+
+    current = Span(trace, name, current_span_id.get() or trace.root.span_id, attributes)
+    trace.add(current)
+    token = current_span_id.set(current.span_id)
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=str(e))
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        current_span_id.reset(token)
+
+
+def add_completed_span(name: str, duration_ms: float, start_ns: Optional[int] = None, **attributes) -> None:
+    """Record externally measured time (e.g. provider queue or model load) in the current trace"""
+    trace = current_trace.get()
+    if trace is not None and duration_ms:
+        trace.add_completed(name, duration_ms, start_ns, **attributes)
+
+
+def parse_trace_mode(value: Optional[str]) -> Optional[str]:
+    """Map an X-Trace header or ?trace= value to the tracing mode: None (off), "trace" or "profile" (trace + profiler)"""
+    if value is None:
+        return None
+    value = value.strip().lower()
+    if value in ("", "0", "false", "no", "off"):
+        return None
+    return "profile" if value == "profile" else "trace"
+
+
+class RequestProfiler:
+    """cProfile, or pyinstrument when installed, around a single request"""
+
+    def __init__(self):
+        self.profiler = PyinstrumentProfiler(async_mode="enabled") if PyinstrumentProfiler else cProfile.Profile()
+
+    def start(self) -> None:
+        if PyinstrumentProfiler:
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self) -> None:
+        if PyinstrumentProfiler:
+            self.profiler.stop()
+        else:
+            self.profiler.disable()
+
+    def save(self, base_path: str) -> str:
+        """Write the profile next to the trace and return its path"""
+        if PyinstrumentProfiler:
+            path = base_path + ".html"
+            with open(path, "w") as f:
+                f.write(self.profiler.output_html())
+        else:
+            path = base_path + ".prof"
+            self.profiler.dump_stats(path)
+        return path
+
+
+# Files written by export_trace: <timestamp>-<trace id prefix>.json, plus .prof/.html profiles
+TRACE_FILE = re.compile(r"^(\d{8}-\d{6}-[0-9a-f]{12})\.(json|prof|html)$")
+
+
+def prune_traces(directory: str, max_files: int) -> int:
+    """Keep only the newest max_files traces (with their profiles) in directory, returns the number removed"""
+    groups: Dict[str, List[str]] = {}
+    for name in os.listdir(directory):
+        match = TRACE_FILE.match(name)
+        if match:
+            groups.setdefault(match.group(1), []).append(os.path.join(directory, name))
+    # Names start with the timestamp, so they sort oldest first
+    removed = 0
+    for base in sorted(groups)[:max(0, len(groups) - max_files)]:
+        for path in groups[base]:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def export_trace(trace: Trace, directory: str, trace_format: str = "chrome",
+                 profiler: Optional[RequestProfiler] = None, max_files: int = 0) -> str:
+    """
+    Write a finished trace (and its profile, if any) to directory and return the trace file path.
+    With max_files > 0, older traces beyond that many are deleted.
+    """
+    os.makedirs(directory, exist_ok=True)
+    base_path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{trace.trace_id[:12]}")
+    payload = trace.to_otlp() if trace_format == "otlp" else trace.to_chrome()
+
+    if profiler is not None:
+        trace.root.set(profile=os.path.basename(profiler.save(base_path)))
+        # Re-render so the root span carries the profile file name
+        payload = trace.to_otlp() if trace_format == "otlp" else trace.to_chrome()
+
+    path = base_path + ".json"
+    with open(path, "w") as f:
+        json.dump(payload, f)
+    if max_files > 0:
+        prune_traces(directory, max_files)
+    return path
@@ -0,0 +1,160 @@
+import difflib
+import hashlib
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any
+
+# Optional brotli support for responses - gzip is always available
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+
+def content_hash(content: str) -> str:
+    """SHA-256 hex digest of the UTF-8 encoded content, as computed by the frontend"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class ContextStore:
+    """In-memory LRU store of uploaded file contents, keyed by content hash and bounded by total size"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def put(self, content: str) -> str:
+        """Store content and return its hash"""
+        digest = content_hash(content)
+        size = len(content.encode("utf-8"))
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                return digest
+            if size > self.max_bytes:
+                raise ValueError("Context is larger than the context store")
+            self._entries[digest] = content
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.encode("utf-8"))
+        return digest
+
+    def get(self, digest: str) -> Optional[str]:
+        """Return the content for a hash, or None if it was never uploaded or has been evicted"""
+        with self._lock:
+            content = self._entries.get(digest)
+            if content is not None:
+                self._entries.move_to_end(digest)
+            return content
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def make_patch(original: str, modified: str) -> List[Dict[str, Any]]:
+    """
+    Line-based patch turning original into modified.
+    Each hunk replaces `delete` lines starting at 0-based line `start` of the original with `insert`.
+    """
+    original_lines = original.split("\n")
+    modified_lines = modified.split("\n")
+    matcher = difflib.SequenceMatcher(None, original_lines, modified_lines, autojunk=False)
+
+    patch = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        patch.append({"start": i1, "delete": i2 - i1, "insert": modified_lines[j1:j2]})
+    return patch
+
+
+def apply_patch(original: str, patch: List[Dict[str, Any]]) -> str:
+    """Apply a patch produced by make_patch"""
+    lines = original.split("\n")
+    # Hunks are in ascending order, so applying them back to front keeps earlier offsets valid
+    for hunk in reversed(patch):
+        lines[hunk["start"]:hunk["start"] + hunk["delete"]] = hunk["insert"]
+    return "\n".join(lines)
+
+
+class RequestDecompressionMiddleware:
+    """ASGI middleware that inflates gzip-encoded request bodies (Content-Encoding: gzip)"""
+
+    def __init__(self, app, max_size: int):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = None
+        for name, value in scope["headers"]:
+            if name == b"content-encoding":
+                encoding = value.decode("latin-1").strip().lower()
+                break
+
+        if encoding in (None, "", "identity"):
+            await self.app(scope, receive, send)
+            return
+        if encoding != "gzip":
+            await self._reject(send, 415, f"Unsupported request Content-Encoding: {encoding}")
+            return
+
+        # Read the compressed body, then inflate it with a hard limit on the output size.
+        # gzip never makes an accepted body much larger, so the same limit bounds the compressed size.
+        compressed = bytearray()
+        more_body = True
+        while more_body:
+            message = await receive()
+            compressed += message.get("body", b"")
+            if len(compressed) > self.max_size:
+                await self._reject(send, 413, "Request body is too large")
+                return
+            more_body = message.get("more_body", False)
+
+        try:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            body = decompressor.decompress(compressed, self.max_size + 1)
+        except zlib.error:
+            await self._reject(send, 400, "Invalid gzip request body")
+            return
+        if len(body) > self.max_size or decompressor.unconsumed_tail:
+            await self._reject(send, 413, "Decompressed request body is too large")
+            return
+        if not decompressor.eof:
+            await self._reject(send, 400, "Truncated gzip request body")
+            return
+
+        headers = [
+            (name, value) for name, value in scope["headers"]
+            if name not in (b"content-encoding", b"content-length")
+        ]
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        scope = dict(scope, headers=headers)
+
+        body_sent = False
+
+        async def receive_decompressed():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, receive_decompressed, send)
+
+    async def _reject(self, send, status_code, detail):
+        payload = json.dumps({"detail": detail}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode("latin-1"))],
+        })
+        await send({"type": "http.response.body", "body": payload})
@@ -0,0 +1,379 @@
+import ast
+import hashlib
+import json
+import re
+import textwrap
+import threading
+import time
+from dataclasses import dataclass
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable
+
+# Optional JavaScript parser - falls back to the bracket checker when not installed
+try:
+    import esprima
+except ImportError:
+    esprima = None
+
+# A validator takes source code and returns an error message, or None when the code is valid
+Validator = Callable[[str], Optional[str]]
+
+VALIDATORS: Dict[str, Validator] = {}
+# Validator keys that only approximate the grammar (e.g. the bracket checker). Their failures are reported
+# as a warning rather than retried, since they can reject valid code.
+HEURISTIC_VALIDATORS = set()
+
+# Language names as sent in CodeRequest.language, mapped to a validator key
+LANGUAGE_ALIASES = {
+    "python": "python", "py": "python",
+    "javascript": "javascript", "js": "javascript", "jsx": "javascript",
+    "typescript": "typescript", "ts": "typescript", "tsx": "typescript",
+    "json": "json",
+    "java": "braces", "c": "braces", "cpp": "braces", "c++": "braces",
+    "csharp": "braces", "cs": "braces", "go": "go", "golang": "go", "rust": "rust", "rs": "rust",
+    "kotlin": "braces", "swift": "braces", "php": "braces",
+    "css": "css", "scss": "braces",
+}
+
+_stats_lock = threading.Lock()
+validation_stats: Dict[str, Any] = {
+    "checked": 0,
+    "failed": 0,
+    "skipped": 0,
+    "total_ms": 0.0,
+    "repairs": 0,
+    "repaired": 0,
+    "by_language": {},
+}
+
+
+@dataclass
+class ValidationResult:
+    ok: bool
+    validator: Optional[str] = None
+    error: Optional[str] = None
+    duration_ms: float = 0.0
+    heuristic: bool = False
+
+
+def register_validator(language: str, validator: Validator, *aliases: str, heuristic: bool = False) -> None:
+    """
+    Register (or replace) the validator used for a language and its aliases.
+    Pass heuristic=True for validators that are not real parsers.
+    """
+    key = language.lower()
+    VALIDATORS[key] = validator
+    if heuristic:
+        HEURISTIC_VALIDATORS.add(key)
+    else:
+        HEURISTIC_VALIDATORS.discard(key)
+    LANGUAGE_ALIASES[key] = key
+    for alias in aliases:
+        LANGUAGE_ALIASES[alias.lower()] = key
+    with _original_checks_lock:
+        _original_checks.clear()
+
+
+def validate_python(code: str) -> Optional[str]:
+    """Check Python syntax with ast.parse"""
+    try:
+        # Selected snippets are often indented method bodies
+        ast.parse(textwrap.dedent(code))
+    except SyntaxError as e:
+        return f"{e.msg} (line {e.lineno})"
+    return None
+
+
+def validate_json(code: str) -> Optional[str]:
+    """Check that the code is a JSON document"""
+    try:
+        json.loads(code)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+# Characters after which a '/' starts a regex literal rather than a division
+REGEX_PRECEDERS = set("(,=:[!&|?{};+-*%<>~^")
+# Keywords after which a '/' starts a regex literal, e.g. `return /x/.test(s)`
+REGEX_KEYWORDS = {"return", "typeof", "case", "in", "of", "delete", "void", "throw", "new", "yield", "await"}
+CLOSERS = {")": "(", "]": "[", "}": "{"}
+
+IDENTIFIER_END = re.compile(r"[A-Za-z_$][\w$]*$")
+# Rust character literal: 'x', '\n', '\x7f', '\u{1F600}' - anything else starting with ' is a lifetime
+RUST_CHAR = re.compile(r"'(?:\\(?:u\{[0-9a-fA-F]{1,6}\}|x[0-9a-fA-F]{2}|.)|[^\\'\n])'")
+# Rust raw string opener: r"...", r#"..."#, br##"..."##
+RUST_RAW_STRING = re.compile(r'b?r(#*)"')
+
+
+def check_balanced_brackets(code: str, quotes: str = "\"'", javascript: bool = False,
+                            rust: bool = False, raw_backticks: bool = False,
+                            line_comments: bool = True) -> Optional[str]:
+    """
+    Check that (), [] and {} are balanced outside of strings and comments.
+    Cheap stand-in for a real parser in brace-delimited languages.
+    With javascript=True, template literals and regex literals are also understood.
+    With rust=True, char literals, lifetimes and raw strings are; with raw_backticks=True, Go raw strings.
+    With line_comments=False, '//' is ordinary text (CSS only has /* */ comments).
+    """
+    stack = []  # open brackets, plus "${" for template literal substitutions
+    line = 1
+    i = 0
+    n = len(code)
+    previous = ""  # last significant character, used to tell regex literals from division
+
+    def scan_template(j):
+        """Scan template literal text from j, returns (next index, entered a ${ substitution)"""
+        nonlocal line
+        while j < n:
+            ch = code[j]
+            if ch == "\\":
+                j += 2
+                continue
+            if ch == "\n":
+                line += 1
+            elif ch == "`":
+                return j + 1, False
+            elif ch == "$" and code.startswith("${", j):
+                return j + 2, True
+            j += 1
+        return j, None
+
+    while i < n:
+        c = code[i]
+        if c == "\n":
+            line += 1
+            i += 1
+            continue
+        if c in " \t\r":
+            i += 1
+            continue
+
+        if line_comments and code.startswith("//", i):
+            end = code.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        if code.startswith("/*", i):
+            end = code.find("*/", i + 2)
+            if end == -1:
+                return f"Unterminated block comment (line {line})"
+            line += code.count("\n", i, end)
+            i = end + 2
+            continue
+
+        if rust and c == "'":
+            match = RUST_CHAR.match(code, i)
+            # Not a char literal, so a lifetime or label - a plain character
+            i = match.end() if match else i + 1
+            previous = c
+            continue
+
+        if rust and c in "br" and not (i and (code[i - 1].isalnum() or code[i - 1] == "_")):
+            match = RUST_RAW_STRING.match(code, i)
+            if match:
+                terminator = '"' + match.group(1)
+                end = code.find(terminator, match.end())
+                if end == -1:
+                    return f"Unterminated raw string (line {line})"
+                line += code.count("\n", i, end)
+                i = end + len(terminator)
+                previous = '"'
+                continue
+
+        if rust and c == '"':
+            # Rust strings may span lines
+            j = i + 1
+            while j < n and code[j] != '"':
+                j += 2 if code[j] == "\\" else 1
+            if j >= n:
+                return f"Unterminated string (line {line})"
+            line += code.count("\n", i, j)
+            i = j + 1
+            previous = c
+            continue
+
+        if raw_backticks and c == "`":
+            end = code.find("`", i + 1)
+            if end == -1:
+                return f"Unterminated raw string (line {line})"
+            line += code.count("\n", i, end)
+            i = end + 1
+            previous = c
+            continue
+
+        if c in quotes:
+            j = i + 1
+            while j < n and code[j] != c and code[j] != "\n":
+                j += 2 if code[j] == "\\" else 1
+            # A quote that is not closed on its line is treated as a plain character (e.g. Rust lifetimes)
+            i = j + 1 if j < n and code[j] == c else i + 1
+            previous = c
+            continue
+
+        if javascript and c == "`":
+            start_line = line
+            i, substitution = scan_template(i + 1)
+            if substitution is None:
+                return f"Unterminated template literal (line {start_line})"
+            if substitution:
+                stack.append("${")
+            previous = "`"
+            continue
+
+        if javascript and c == "/" and starts_regex(code, i, previous):
+            # Skip a regex literal, including character classes that may contain '/'
+            j = i + 1
+            in_class = False
+            while j < n and code[j] != "\n":
+                if code[j] == "\\":
+                    j += 2
+                    continue
+                if code[j] == "[":
+                    in_class = True
+                elif code[j] == "]":
+                    in_class = False
+                elif code[j] == "/" and not in_class:
+                    break
+                j += 1
+            i = j + 1
+            previous = "/"
+            continue
+
+        if c in "([{":
+            stack.append(c)
+        elif c in CLOSERS:
+            if c == "}" and stack and stack[-1] == "${":
+                # End of a template substitution, continue scanning the template text
+                stack.pop()
+                start_line = line
+                i, substitution = scan_template(i + 1)
+                if substitution is None:
+                    return f"Unterminated template literal (line {start_line})"
+                if substitution:
+                    stack.append("${")
+                previous = "`"
+                continue
+            if not stack or stack[-1] != CLOSERS[c]:
+                return f"Unexpected '{c}' (line {line})"
+            stack.pop()
+
+        previous = c
+        i += 1
+
+    if stack:
+        return f"Unclosed '{stack[-1]}' at end of code"
+    return None
+
+
+def starts_regex(code: str, i: int, previous: str) -> bool:
+    """Whether the '/' at code[i] starts a regex literal, given the last significant character before it"""
+    if i > 0 and code[i - 1] == "<":
+        # JSX closing tag, e.g. </li>
+        return False
+    if previous == "" or previous in REGEX_PRECEDERS:
+        return True
+    if previous.isalnum() or previous in "_$":
+        match = IDENTIFIER_END.search(code[max(0, i - 32):i].rstrip())
+        return match is not None and match.group(0) in REGEX_KEYWORDS
+    return False
+
+
+def validate_javascript(code: str) -> Optional[str]:
+    """Check JavaScript with esprima when available, otherwise check bracket balance"""
+    if esprima is not None:
+        try:
+            esprima.parseModule(code, {"jsx": True, "tolerant": False})
+            return None
+        except Exception:
+            # Retry as a script - some snippets are not valid as ES modules
+            try:
+                esprima.parseScript(code, {"jsx": True, "tolerant": False})
+                return None
+            except Exception as e:
+                return str(e)
+    return check_balanced_brackets(code, javascript=True)
+
+
+# Results for original code, which is checked again on every attempt of a request.
+# Keyed by a digest so the cache never holds whole files.
+ORIGINAL_CHECK_CACHE_SIZE = 32
+_original_checks: "OrderedDict[tuple, Optional[str]]" = OrderedDict()
+_original_checks_lock = threading.Lock()
+
+
+def _run_validator(key: str, code: str) -> Optional[str]:
+    return VALIDATORS[key](code)
+
+
+def _check_original(key: str, code: str) -> Optional[str]:
+    cache_key = (key, hashlib.sha256(code.encode("utf-8", "surrogatepass")).digest())
+    with _original_checks_lock:
+        if cache_key in _original_checks:
+            _original_checks.move_to_end(cache_key)
+            return _original_checks[cache_key]
+    error = _run_validator(key, code)
+    with _original_checks_lock:
+        _original_checks[cache_key] = error
+        if len(_original_checks) > ORIGINAL_CHECK_CACHE_SIZE:
+            _original_checks.popitem(last=False)
+    return error
+
+
+register_validator("python", validate_python, "py")
+register_validator("javascript", validate_javascript, "js", "jsx", heuristic=esprima is None)
+# esprima cannot parse type annotations, so TypeScript always gets the JavaScript-aware bracket checker
+register_validator("typescript", lambda code: check_balanced_brackets(code, javascript=True), "ts", "tsx", heuristic=True)
+register_validator("json", validate_json)
+register_validator("braces", check_balanced_brackets, heuristic=True)
+register_validator("rust", lambda code: check_balanced_brackets(code, quotes="", rust=True), "rs", heuristic=True)
+# SCSS keeps the default checker, since it does allow // comments
+register_validator("css", lambda code: check_balanced_brackets(code, line_comments=False), heuristic=True)
+register_validator("go", lambda code: check_balanced_brackets(code, raw_backticks=True), "golang", heuristic=True)
+
+
+def validate_code(code: str, language: str, original_code: Optional[str] = None) -> ValidationResult:
+    """
+    Validate generated code for a language.
+    If the original code does not pass the same check (e.g. a partial selection), validation is skipped
+    so that fragments are never rejected for problems they already had.
+    """
+    started = time.perf_counter()
+    key = LANGUAGE_ALIASES.get((language or "").lower())
+
+    if key is None or key not in VALIDATORS:
+        return ValidationResult(ok=True)
+
+    if original_code is not None and _check_original(key, original_code) is not None:
+        result = ValidationResult(ok=True, validator=key)
+        _update_stats(language, result, skipped=True, started=started)
+        return result
+
+    error = _run_validator(key, code)
+    result = ValidationResult(ok=error is None, validator=key, error=error, heuristic=key in HEURISTIC_VALIDATORS)
+    _update_stats(language, result, skipped=False, started=started)
+    return result
+
+
+def _update_stats(language: str, result: ValidationResult, skipped: bool, started: float) -> None:
+    result.duration_ms = (time.perf_counter() - started) * 1000
+    with _stats_lock:
+        language_stats = validation_stats["by_language"].setdefault(
+            language.lower(), {"checked": 0, "failed": 0, "skipped": 0, "total_ms": 0.0}
+        )
+        for stats in (validation_stats, language_stats):
+            stats["skipped" if skipped else "checked"] += 1
+            stats["failed"] += 0 if result.ok else 1
+            stats["total_ms"] += result.duration_ms
+
+
+def record_repair(succeeded: bool) -> None:
+    """Count a repair retry triggered by a failed validation"""
+    with _stats_lock:
+        validation_stats["repairs"] += 1
+        validation_stats["repaired"] += 1 if succeeded else 0
+
+
+def get_validation_stats() -> Dict[str, Any]:
+    """Return a snapshot of the validation counters"""
+    with _stats_lock:
+        return json.loads(json.dumps(validation_stats))
@@ -0,0 +1,51 @@
+// Benchmark for the DiffView diff pipeline on large inputs
+// Run with: npx tsx bench-diff.ts [lines]
+import { diffLines } from 'diff';
+import { computeDiff } from './components/diff/lineDiff';
+
+const LINES = Number(process.argv[2]) || 50000;
+const RUNS = 5;
+
+const makeFile = (lines: number): string[] =>
+  Array.from({ length: lines }, (_, i) => `  const value${i} = compute(${i}, "${(i * 7919) % 1000}"); // line ${i}`);
+
+const time = (label: string, fn: () => unknown) => {
+  fn(); // Warm up
+  const timings: number[] = [];
+  for (let run = 0; run < RUNS; run++) {
+    const started = performance.now();
+    fn();
+    timings.push(performance.now() - started);
+  }
+  timings.sort((a, b) => a - b);
+  console.log(`${label.padEnd(48)} median ${timings[Math.floor(RUNS / 2)].toFixed(2)} ms   max ${timings[RUNS - 1].toFixed(2)} ms`);
+};
+
+const originalLines = makeFile(LINES);
+const original = originalLines.join('\n');
+
+// A selection edit in the middle of the file: 20 lines replaced by 30
+const selectionStart = Math.floor(LINES / 2);
+const selectionEnd = selectionStart + 19;
+const replacement = Array.from({ length: 30 }, (_, i) => `  const edited${i} = transform(${i});`);
+const selectionEdit = [
+  ...originalLines.slice(0, selectionStart - 1),
+  ...replacement,
+  ...originalLines.slice(selectionEnd),
+].join('\n');
+
+// Scattered edits across the whole file, where trimming cannot help
+const scattered = originalLines.map((line, i) => (i % 500 === 0 ? `${line} // edited` : line)).join('\n');
+
+console.log(`Diff benchmark on ${LINES} lines (${RUNS} runs)\n`);
+
+time('selection edit: full diffLines', () => diffLines(original, selectionEdit));
+time('selection edit: computeDiff (trimmed)', () => computeDiff(original, selectionEdit));
+time('selection edit: computeDiff (selection hint)', () =>
+  computeDiff(original, selectionEdit, { startLine: selectionStart, endLine: selectionEnd })
+);
+time('scattered edits: full diffLines', () => diffLines(original, scattered));
+time('scattered edits: computeDiff', () => computeDiff(original, scattered));
+
+const stats = computeDiff(original, selectionEdit, { startLine: selectionStart, endLine: selectionEnd });
+console.log(`\nSelection edit stats: +${stats.added} -${stats.removed} ~${stats.changed} in ${stats.hunks} hunk(s)`);
@@ -1,12 +1,7 @@
 import React, { useState, useRef, useEffect } from 'react';
-import axios from 'axios';
 import CodeEditor from './CodeEditor';
 import DiffView from './DiffView';
-
-interface ApiResponse {
-  modified_code: string;
-  explanation: string;
-}
+import { iterateCode, isAbortError, mergeSelection } from '@/app/api';
 
 interface Selection {
   text: string;
@@ -29,6 +24,9 @@ const LANGUAGE_OPTIONS = [
   { value: 'cpp', label: 'C++' },
 ];
 
+// Rapid resubmissions within this window only send the last one
+const SUBMIT_DEBOUNCE_MS = 150;
+
 const CodeIterator: React.FC = () => {
   const [code, setCode] = useState<string>('// Enter your code here');
   const [instruction, setInstruction] = useState<string>('');
@@ -40,7 +38,11 @@ const CodeIterator: React.FC = () => {
   const [language, setLanguage] = useState<string>('javascript');
   const [isSuccess, setIsSuccess] = useState<boolean>(false);
   const [selectedCode, setSelectedCode] = useState<Selection | null>(null);
+  // Lines the current result replaced, so the diff can be limited to them
+  const [resultSelection, setResultSelection] = useState<{ startLine: number; endLine: number } | undefined>(undefined);
   const [useGroq, setUseGroq] = useState<boolean>(true); // Default to using Groq API
+  // Until the user flips the toggle, the server's default and adaptive routing pick the provider
+  const [groqChosen, setGroqChosen] = useState<boolean>(false);
   const [viewOriginalCode, setViewOriginalCode] = useState<boolean>(false); // For toggling between original and modified code
   const [showDiffHighlighting, setShowDiffHighlighting] = useState<boolean>(true); // For enabling/disabling diff highlighting
   const [showSideBySideDiff, setShowSideBySideDiff] = useState<boolean>(false); // For showing side-by-side diff
@@ -56,6 +58,14 @@ const CodeIterator: React.FC = () => {
   
   const editorRef = useRef<EditorRefType>(null);
 
+  // Controller for the request in flight, so it can be cancelled or superseded
+  const requestControllerRef = useRef<AbortController | null>(null);
+  // Identifies the request whose result is on screen - submitting it again asks for a fresh result
+  const shownRequestRef = useRef<string | null>(null);
+
+  // Abort any pending request when the component unmounts
+  useEffect(() => () => requestControllerRef.current?.abort(), []);
+
   // Handle selection change in the editor
   const handleSelectionChange = (selection: Selection | null) => {
     setSelectedCode(selection);
@@ -68,6 +78,12 @@ const CodeIterator: React.FC = () => {
     }
   };
 
+  // Replace the editor code. The result's selection no longer describes the new code, so drop it.
+  const updateCode = (value: string) => {
+    setCode(value);
+    setResultSelection(undefined);
+  };
+
   // Show notification
   const showNotification = (message: string, type: 'success' | 'error' | 'info' = 'info') => {
     setNotification({ message, type });
@@ -87,30 +103,22 @@ const CodeIterator: React.FC = () => {
       return;
     }
 
+    // A new submission supersedes any request still in flight
+    requestControllerRef.current?.abort();
+    const controller = new AbortController();
+    requestControllerRef.current = controller;
+
     setError('');
     setLoading(true);
     setShowDiff(false);
     setIsSuccess(false);
 
     try {
-      console.log('Sending request to API...');
       showNotification('Processing your code with AI...', 'info');
       
       // Determine what code to send based on selection
       const codeToSend = selectedCode ? selectedCode.text : code;
-      
-      console.log('Request payload:', {
-        code: codeToSend.substring(0, 100) + '...',
-        instruction,
-        language,
-        selection: selectedCode ? {
-          start_line: selectedCode.startLine,
-          end_line: selectedCode.endLine
-        } : undefined,
-        use_groq: useGroq
-      });
-      
-      const response = await axios.post<ApiResponse>('http://localhost:8000/iterate-code', {
+      const request = {
         code: codeToSend,
         instruction,
         language,
@@ -119,53 +127,28 @@ const CodeIterator: React.FC = () => {
           start_line: selectedCode.startLine,
           end_line: selectedCode.endLine
         } : undefined,
-        use_groq: useGroq // Send the user's preference for using Groq API
-      });
-
-      const { modified_code, explanation: resp_explanation } = response.data;
+        use_groq: groqChosen ? useGroq : undefined // Only send an explicit choice, which pins Groq first
+      };
+      const requestId = JSON.stringify(request);
       
-      console.log('API Response:', {
-        modified_code_length: modified_code.length,
-        explanation_length: resp_explanation.length,
-        modified_code_preview: modified_code.substring(0, 100) + '...',
-        code_changed: modified_code.trim() !== codeToSend.trim()
+      const { modified_code, explanation: resp_explanation } = await iterateCode(request, {
+        signal: controller.signal,
+        debounceMs: SUBMIT_DEBOUNCE_MS,
+        // Resubmitting the request already on screen is a retry, so regenerate instead of reusing the cache
+        bypassCache: requestId === shownRequestRef.current,
       });
       
-      // VERY IMPORTANT: Save exact modified code from API for comparison
-      const originalModifiedCode = modified_code;
-      
       // If we had a selection, we need to replace just that part in the full code
-      let finalModifiedCode = modified_code;
-      if (selectedCode) {
-        const lines = code.split('\n');
-        const beforeSelection = lines.slice(0, selectedCode.startLine - 1).join('\n');
-        const afterSelection = lines.slice(selectedCode.endLine).join('\n');
-        
-        // Build the new full code by replacing just the selected part
-        finalModifiedCode = beforeSelection + 
-          (beforeSelection ? '\n' : '') + 
-          modified_code + 
-          (afterSelection ? '\n' : '') + 
-          afterSelection;
-      }
-      
-      console.log('Final code comparison:', {
-        original_length: code.length,
-        modified_length: finalModifiedCode.length,
-        are_identical: finalModifiedCode.trim() === code.trim()
-      });
+      const finalModifiedCode = selectedCode
+        ? mergeSelection(code, selectedCode.startLine, selectedCode.endLine, modified_code)
+        : modified_code;
       
       // FORCE DIFFERENT CODE: Always show diff and set success if API returned any code
-      if (originalModifiedCode.length > 10) {
+      if (modified_code.length > 10) {
         setIsSuccess(true);
-        
-        // Store the modified code to be displayed
-        console.log("Setting modifiedCode with length:", finalModifiedCode.length);
-        
-        // Important: Store the plain finalModifiedCode, not a reference to code
-        const independentModifiedCode = String(finalModifiedCode);
-        setModifiedCode(independentModifiedCode);
-        
+        setModifiedCode(finalModifiedCode);
+        shownRequestRef.current = requestId;
+        setResultSelection(selectedCode ? { startLine: selectedCode.startLine, endLine: selectedCode.endLine } : undefined);
         setExplanation(resp_explanation);
         setShowDiff(true);
         showNotification('Code modification received!', 'success');
@@ -177,18 +160,34 @@ const CodeIterator: React.FC = () => {
         setIsSuccess(false);
       }
     } catch (err: any) {
+      if (isAbortError(err)) {
+        // Superseded or cancelled by the user - nothing to report
+        return;
+      }
       console.error('Error calling API:', err);
-      if (err.response?.data?.detail) {
-        setError(`Failed to process the code: ${err.response.data.detail}`);
+      if (err.message?.startsWith('API Error: ')) {
+        setError(`Failed to process the code: ${err.message.slice('API Error: '.length)}`);
       } else {
         setError('Failed to process the code. Please try again.');
       }
       showNotification('Error processing your code. Please try again.', 'error');
     } finally {
-      setLoading(false);
+      // Only the latest submission owns the loading state
+      if (requestControllerRef.current === controller) {
+        requestControllerRef.current = null;
+        setLoading(false);
+      }
     }
   };
 
+  // Cancel the request in flight
+  const handleCancel = () => {
+    requestControllerRef.current?.abort();
+    requestControllerRef.current = null;
+    setLoading(false);
+    showNotification('Request cancelled', 'info');
+  };
+
   // Integrate the modified code into the editor
   const handleIntegrateCode = () => {
     // Use modifiedCodeRef as fallback in case state has been lost
@@ -203,10 +202,11 @@ const CodeIterator: React.FC = () => {
       const safeModifiedCode = String(currentModifiedCode);
       
       // Directly set the code state to the modified code
-      setCode(safeModifiedCode);
+      updateCode(safeModifiedCode);
       
       // Important: reset the modified code and hide diff to prevent confusion
       setModifiedCode('');
+      shownRequestRef.current = null;
       setShowDiff(false);
       setViewOriginalCode(false);
       
@@ -232,9 +232,9 @@ const CodeIterator: React.FC = () => {
     setLanguage(e.target.value);
     // Optionally, you could provide language-specific starter code here
     if (e.target.value === 'python') {
-      setCode('# Enter your Python code here\n\n');
+      updateCode('# Enter your Python code here\n\n');
     } else if (e.target.value === 'javascript') {
-      setCode('// Enter your JavaScript code here\n\n');
+      updateCode('// Enter your JavaScript code here\n\n');
     }
     // Clear any selection when changing languages
     setSelectedCode(null);
@@ -243,6 +243,7 @@ const CodeIterator: React.FC = () => {
   // Toggle between Groq and Ollama
   const handleModelToggle = () => {
     setUseGroq(!useGroq);
+    setGroqChosen(true);
     showNotification(`Switched to ${!useGroq ? 'Groq' : 'Ollama'} AI model`, 'info');
   };
 
@@ -378,6 +379,7 @@ const CodeIterator: React.FC = () => {
                 modifiedCode={modifiedCode}
                 language={language}
                 height="100%"
+                selection={resultSelection}
                 onAcceptChanges={() => {
                   handleIntegrateCode();
                 }}
@@ -387,7 +389,7 @@ const CodeIterator: React.FC = () => {
                 <CodeEditor 
                   ref={editorRef}
                   code={showDiff && isSuccess && !showSideBySideDiff ? modifiedCode : code} 
-                  onChange={(value: string | undefined) => setCode(value || '')} 
+                  onChange={(value: string | undefined) => updateCode(value || '')} 
                   onSelectionChange={handleSelectionChange}
                   height="calc(100vh - 120px)"
                   language={language}
@@ -480,6 +482,15 @@ const CodeIterator: React.FC = () => {
                 </div>
               ) : "Submit"}
             </button>
+
+            {loading && (
+              <button
+                className="cursor-button text-xs px-2 py-1 self-center"
+                onClick={handleCancel}
+              >
+                Cancel
+              </button>
+            )}
             
             {/* Explanation area */}
             {explanation && (
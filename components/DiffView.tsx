@@ -1,12 +1,41 @@
-import React, { useEffect, useState, useRef } from 'react';
+import React, { useMemo, useState, useRef } from 'react';
 import { DiffEditor, Monaco } from '@monaco-editor/react';
 import { editor } from 'monaco-editor';
+import { LineRange } from './diff/lineDiff';
+import { useDiffStats } from './diff/useDiffStats';
+
+// Above this many lines, switch Monaco to its faster diff and collapse unchanged regions
+const LARGE_FILE_LINES = 5000;
+
+const countLines = (text: string): number => {
+  let count = 1;
+  let index = text.indexOf('\n');
+  while (index !== -1) {
+    count++;
+    index = text.indexOf('\n', index + 1);
+  }
+  return count;
+};
+
+// Normalize whitespace to prevent unnecessary diff highlighting
+const normalizeCode = (code: string): string => {
+  // Just trim the code, don't do any other normalization to ensure
+  // we see all differences including whitespace
+  return code.replace(/\r\n/g, '\n').trim();
+};
+
+// Number of whole lines normalizeCode removes from the start of the code
+const trimmedLeadingLines = (code: string): number => {
+  const leading = /^\s*/.exec(code.replace(/\r\n/g, '\n'))![0];
+  return countLines(leading) - 1;
+};
 
 interface DiffViewProps {
   originalCode: string;
   modifiedCode: string;
   language?: string;
   height?: string;
+  selection?: LineRange; // Lines of originalCode that were edited, when known
   onAcceptChanges?: () => void;
 }
 
@@ -15,17 +44,29 @@ const DiffView: React.FC<DiffViewProps> = ({
   modifiedCode,
   language = 'javascript',
   height = '500px',
+  selection,
   onAcceptChanges
 }) => {
   const [renderSideBySide, setRenderSideBySide] = useState<boolean>(true);
-  const [changeCount, setChangeCount] = useState<{ added: number; removed: number; changed: number }>({ 
-    added: 0, 
-    removed: 0,
-    changed: 0 
-  });
   const diffEditorRef = useRef<editor.IStandaloneDiffEditor | null>(null);
   const monacoRef = useRef<Monaco | null>(null);
   
+  // Only re-normalize (and hand Monaco new strings) when the inputs actually change
+  const normalizedOriginal = useMemo(() => normalizeCode(originalCode), [originalCode]);
+  const normalizedModified = useMemo(() => normalizeCode(modifiedCode), [modifiedCode]);
+  // The selection refers to originalCode, so shift it by the lines trimmed from its start
+  const normalizedSelection = useMemo(() => {
+    if (!selection) return undefined;
+    const shift = trimmedLeadingLines(originalCode);
+    return { startLine: selection.startLine - shift, endLine: selection.endLine - shift };
+  }, [originalCode, selection?.startLine, selection?.endLine]);
+  // Change counts are computed in a Web Worker from the same text Monaco shows, limited to the edited range
+  const { stats: changeCount, computing } = useDiffStats(normalizedOriginal, normalizedModified, normalizedSelection);
+  const isLargeFile = useMemo(
+    () => Math.max(countLines(normalizedOriginal), countLines(normalizedModified)) > LARGE_FILE_LINES,
+    [normalizedOriginal, normalizedModified]
+  );
+
   // Define options for the diff editor
   const options: editor.IDiffEditorConstructionOptions = {
     readOnly: true,
@@ -41,7 +82,11 @@ const DiffView: React.FC<DiffViewProps> = ({
     renderIndicators: true, // Show indicators for changes
     renderOverviewRuler: true, // Show overview ruler
     diffWordWrap: 'on',
-    diffAlgorithm: 'advanced', // Use advanced diff algorithm for better results
+    // Advanced diff gives better results, but legacy is much faster on very large files
+    diffAlgorithm: isLargeFile ? 'legacy' : 'advanced',
+    // Collapse unchanged regions so large files only render the lines around changes
+    hideUnchangedRegions: { enabled: isLargeFile },
+    maxComputationTime: 5000,
   };
 
   const handleEditorDidMount = (
@@ -51,50 +96,10 @@ const DiffView: React.FC<DiffViewProps> = ({
     diffEditorRef.current = diffEditor;
     monacoRef.current = monaco;
     
-    // Add custom styling to highlight the diff better
-    const originalModel = diffEditor.getOriginalEditor().getModel();
-    const modifiedModel = diffEditor.getModifiedEditor().getModel();
-    
-    if (originalModel && modifiedModel) {
-      // Set editor options
-      diffEditor.updateOptions({
-        renderSideBySide: renderSideBySide,
-      });
-      
-      // Analyze and count changes
-      setTimeout(() => {
-        const diffChanges = diffEditor.getLineChanges();
-        if (diffChanges) {
-          let added = 0;
-          let removed = 0;
-          let changed = 0;
-          
-          diffChanges.forEach(change => {
-            // Count original model deletions
-            if (change.originalEndLineNumber > 0) {
-              const deletedLines = change.originalEndLineNumber - change.originalStartLineNumber + 1;
-              removed += deletedLines;
-            }
-            
-            // Count modified model additions
-            if (change.modifiedEndLineNumber > 0) {
-              const addedLines = change.modifiedEndLineNumber - change.modifiedStartLineNumber + 1;
-              added += addedLines;
-            }
-            
-            // Count changes (lines that were modified)
-            if (change.originalEndLineNumber > 0 && change.modifiedEndLineNumber > 0) {
-              changed += Math.min(
-                change.originalEndLineNumber - change.originalStartLineNumber + 1,
-                change.modifiedEndLineNumber - change.modifiedStartLineNumber + 1
-              );
-            }
-          });
-          
-          setChangeCount({ added, removed, changed });
-        }
-      }, 500); // Small delay to ensure the diff is computed
-    }
+    // Set editor options
+    diffEditor.updateOptions({
+      renderSideBySide: renderSideBySide,
+    });
   };
 
   // Toggle between side-by-side and inline diff
@@ -119,38 +124,6 @@ const DiffView: React.FC<DiffViewProps> = ({
     }
   };
 
-  // Normalize whitespace to prevent unnecessary diff highlighting
-  const normalizeCode = (code: string): string => {
-    // Just trim the code, don't do any other normalization to ensure
-    // we see all differences including whitespace
-    return code.replace(/\r\n/g, '\n').trim();
-  };
-
-  // Log differences for debugging
-  useEffect(() => {
-    console.log("DiffView comparing codes:");
-    console.log("Original (first 100 chars):", originalCode.substring(0, 100));
-    console.log("Modified (first 100 chars):", modifiedCode.substring(0, 100));
-    
-    // Compare line by line for debugging
-    const origLines = originalCode.split('\n');
-    const modLines = modifiedCode.split('\n');
-    
-    let diffCount = 0;
-    for (let i = 0; i < Math.min(origLines.length, modLines.length); i++) {
-      if (origLines[i] !== modLines[i]) {
-        diffCount++;
-        if (diffCount <= 5) { // Limit to first 5 diffs for brevity
-          console.log(`Diff at line ${i+1}:`, {
-            orig: origLines[i],
-            mod: modLines[i]
-          });
-        }
-      }
-    }
-    console.log(`Total diff lines: ${diffCount}`);
-  }, [originalCode, modifiedCode]);
-
   return (
     <div className="rounded-md overflow-hidden border border-gray-700 cursor-ui">
       <div className="cursor-toolbar flex-wrap">
@@ -168,6 +141,9 @@ const DiffView: React.FC<DiffViewProps> = ({
             <span className="cursor-tag bg-blue-600 mr-2">~{changeCount.changed}</span>
             <span className="text-xs">Changed</span>
           </span>
+          {computing && (
+            <span className="ml-3 text-xs text-gray-500">Computing diff...</span>
+          )}
         </div>
         <div className="flex mt-2 md:mt-0 space-x-2">
           <button 
@@ -211,8 +187,8 @@ const DiffView: React.FC<DiffViewProps> = ({
       <DiffEditor
         height={height}
         language={language}
-        original={normalizeCode(originalCode)}
-        modified={normalizeCode(modifiedCode)}
+        original={normalizedOriginal}
+        modified={normalizedModified}
         onMount={handleEditorDidMount}
         theme="vs-dark"
         options={{
@@ -0,0 +1,29 @@
+import { computeDiff, DiffHunk, DiffStats, LineRange } from './lineDiff';
+
+export interface DiffJob {
+  id: number;
+  originalCode: string;
+  modifiedCode: string;
+  selection?: LineRange;
+}
+
+export interface DiffWorkerMessage {
+  id: number;
+  type: 'progress' | 'done';
+  hunks: DiffHunk[];
+  stats: DiffStats;
+}
+
+// Worker global scope - typed loosely because the project only loads the DOM lib
+const ctx = self as unknown as {
+  onmessage: ((event: MessageEvent<DiffJob>) => void) | null;
+  postMessage: (message: DiffWorkerMessage) => void;
+};
+
+ctx.onmessage = (event) => {
+  const { id, originalCode, modifiedCode, selection } = event.data;
+  const stats = computeDiff(originalCode, modifiedCode, selection, (hunks, running) => {
+    ctx.postMessage({ id, type: 'progress', hunks, stats: running });
+  });
+  ctx.postMessage({ id, type: 'done', hunks: [], stats });
+};
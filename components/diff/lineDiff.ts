@@ -0,0 +1,190 @@
+import { diffLines } from 'diff';
+
+// Lines selected in the original code (1-based, inclusive)
+export interface LineRange {
+  startLine: number;
+  endLine: number;
+}
+
+// A changed region, with 1-based start lines in the full original/modified code
+export interface DiffHunk {
+  originalStart: number;
+  originalLines: number;
+  modifiedStart: number;
+  modifiedLines: number;
+}
+
+export interface DiffStats {
+  added: number;
+  removed: number;
+  changed: number;
+  hunks: number;
+}
+
+// Half-open line index ranges ([start, end)) of the region that actually needs diffing
+export interface DiffWindow {
+  originalStart: number;
+  originalEnd: number;
+  modifiedStart: number;
+  modifiedEnd: number;
+}
+
+// Give up on an exact diff after this long and report the window as a single hunk
+const DIFF_TIMEOUT_MS = 2000;
+
+export const emptyStats = (): DiffStats => ({ added: 0, removed: 0, changed: 0, hunks: 0 });
+
+export const splitLines = (text: string): string[] => text.replace(/\r\n/g, '\n').split('\n');
+
+const linesEqual = (original: string[], modified: string[], originalStart: number, modifiedStart: number, count: number) => {
+  for (let i = 0; i < count; i++) {
+    if (original[originalStart + i] !== modified[modifiedStart + i]) return false;
+  }
+  return true;
+};
+
+/**
+ * Narrow the diff to the lines that can differ.
+ * A selection bounds the window when the lines outside it really are unchanged (it may be stale);
+ * identical leading and trailing lines are then trimmed.
+ */
+export const findDiffWindow = (original: string[], modified: string[], selection?: LineRange): DiffWindow => {
+  let window: DiffWindow = {
+    originalStart: 0,
+    originalEnd: original.length,
+    modifiedStart: 0,
+    modifiedEnd: modified.length,
+  };
+
+  if (selection) {
+    // Everything outside the selection is copied verbatim into the modified file
+    const start = selection.startLine - 1;
+    const suffix = original.length - selection.endLine;
+    const modifiedEnd = modified.length - suffix;
+    if (
+      start >= 0 && suffix >= 0 && modifiedEnd >= start &&
+      linesEqual(original, modified, 0, 0, start) &&
+      linesEqual(original, modified, selection.endLine, modifiedEnd, suffix)
+    ) {
+      window = { originalStart: start, originalEnd: selection.endLine, modifiedStart: start, modifiedEnd };
+    }
+  }
+
+  while (
+    window.originalStart < window.originalEnd &&
+    window.modifiedStart < window.modifiedEnd &&
+    original[window.originalStart] === modified[window.modifiedStart]
+  ) {
+    window.originalStart++;
+    window.modifiedStart++;
+  }
+  while (
+    window.originalEnd > window.originalStart &&
+    window.modifiedEnd > window.modifiedStart &&
+    original[window.originalEnd - 1] === modified[window.modifiedEnd - 1]
+  ) {
+    window.originalEnd--;
+    window.modifiedEnd--;
+  }
+  return window;
+};
+
+const countLines = (value: string): number => {
+  let count = 0;
+  for (let i = 0; i < value.length; i++) {
+    if (value.charCodeAt(i) === 10) count++;
+  }
+  // Each part ends with a newline except possibly the last one
+  return value.length > 0 && value.charCodeAt(value.length - 1) !== 10 ? count + 1 : count;
+};
+
+const addHunk = (stats: DiffStats, hunk: DiffHunk) => {
+  stats.added += hunk.modifiedLines;
+  stats.removed += hunk.originalLines;
+  stats.changed += Math.min(hunk.originalLines, hunk.modifiedLines);
+  stats.hunks += 1;
+};
+
+/**
+ * Diff two versions of a file and report hunks in batches, so callers can update counts as they arrive.
+ * onBatch receives the new hunks and the running totals.
+ */
+export const computeDiff = (
+  originalCode: string,
+  modifiedCode: string,
+  selection?: LineRange,
+  onBatch?: (hunks: DiffHunk[], stats: DiffStats) => void,
+  batchSize = 200
+): DiffStats => {
+  const original = splitLines(originalCode);
+  const modified = splitLines(modifiedCode);
+  const window = findDiffWindow(original, modified, selection);
+  const stats = emptyStats();
+
+  if (window.originalStart === window.originalEnd && window.modifiedStart === window.modifiedEnd) {
+    onBatch?.([], stats);
+    return stats;
+  }
+
+  const toText = (lines: string[], start: number, end: number) =>
+    start === end ? '' : lines.slice(start, end).join('\n') + '\n';
+  const parts = diffLines(
+    toText(original, window.originalStart, window.originalEnd),
+    toText(modified, window.modifiedStart, window.modifiedEnd),
+    { timeout: DIFF_TIMEOUT_MS }
+  );
+
+  if (!parts) {
+    // Too expensive to diff exactly - treat the whole window as replaced
+    const hunk: DiffHunk = {
+      originalStart: window.originalStart + 1,
+      originalLines: window.originalEnd - window.originalStart,
+      modifiedStart: window.modifiedStart + 1,
+      modifiedLines: window.modifiedEnd - window.modifiedStart,
+    };
+    addHunk(stats, hunk);
+    onBatch?.([hunk], { ...stats });
+    return stats;
+  }
+
+  let originalLine = window.originalStart + 1;
+  let modifiedLine = window.modifiedStart + 1;
+  let pending: DiffHunk | null = null;
+  let batch: DiffHunk[] = [];
+
+  const flush = () => {
+    if (pending) {
+      addHunk(stats, pending);
+      batch.push(pending);
+      pending = null;
+    }
+    if (batch.length >= batchSize) {
+      onBatch?.(batch, { ...stats });
+      batch = [];
+    }
+  };
+
+  parts.forEach((part) => {
+    const lines = part.count ?? countLines(part.value);
+    if (!part.added && !part.removed) {
+      flush();
+      originalLine += lines;
+      modifiedLine += lines;
+      return;
+    }
+    if (!pending) {
+      pending = { originalStart: originalLine, originalLines: 0, modifiedStart: modifiedLine, modifiedLines: 0 };
+    }
+    if (part.removed) {
+      pending.originalLines += lines;
+      originalLine += lines;
+    } else {
+      pending.modifiedLines += lines;
+      modifiedLine += lines;
+    }
+  });
+  flush();
+  onBatch?.(batch, { ...stats });
+
+  return stats;
+};
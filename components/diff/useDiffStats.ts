@@ -0,0 +1,92 @@
+import { useEffect, useRef, useState } from 'react';
+import { computeDiff, DiffStats, emptyStats, LineRange } from './lineDiff';
+import type { DiffWorkerMessage } from './diffWorker';
+
+// Wait for typing to settle before diffing again
+const DIFF_DEBOUNCE_MS = 100;
+
+// Set once the worker script has failed, so later diffs go straight to the main thread
+let workerFailed = false;
+
+const createWorker = (): Worker | null => {
+  if (workerFailed || typeof Worker === 'undefined') return null;
+  try {
+    return new Worker(new URL('./diffWorker.ts', import.meta.url));
+  } catch {
+    return null;
+  }
+};
+
+/**
+ * Diff statistics computed off the main thread.
+ * Stats update as hunk batches arrive; a newer input supersedes (and terminates) a diff still running.
+ */
+export const useDiffStats = (originalCode: string, modifiedCode: string, selection?: LineRange) => {
+  const [stats, setStats] = useState<DiffStats>(emptyStats);
+  const [computing, setComputing] = useState<boolean>(false);
+  const workerRef = useRef<Worker | null>(null);
+  const busyRef = useRef<boolean>(false);
+  const jobIdRef = useRef<number>(0);
+
+  const selectionStart = selection?.startLine;
+  const selectionEnd = selection?.endLine;
+
+  useEffect(() => {
+    const id = ++jobIdRef.current;
+    const range = selectionStart !== undefined && selectionEnd !== undefined
+      ? { startLine: selectionStart, endLine: selectionEnd }
+      : undefined;
+
+    const timer = setTimeout(() => {
+      // A worker still busy with an outdated diff is cheaper to replace than to wait for
+      if (busyRef.current && workerRef.current) {
+        workerRef.current.terminate();
+        workerRef.current = null;
+      }
+      if (!workerRef.current) {
+        workerRef.current = createWorker();
+      }
+
+      const worker = workerRef.current;
+      setComputing(true);
+
+      if (!worker) {
+        // No worker support - compute on the main thread
+        setStats(computeDiff(originalCode, modifiedCode, range));
+        setComputing(false);
+        return;
+      }
+
+      busyRef.current = true;
+      // The worker script failed to load or threw - drop it and compute on the main thread instead
+      worker.onerror = (event: ErrorEvent) => {
+        event.preventDefault();
+        workerFailed = true;
+        worker.terminate();
+        if (workerRef.current === worker) workerRef.current = null;
+        busyRef.current = false;
+        if (id !== jobIdRef.current) return;
+        setStats(computeDiff(originalCode, modifiedCode, range));
+        setComputing(false);
+      };
+      worker.onmessage = (event: MessageEvent<DiffWorkerMessage>) => {
+        if (event.data.id !== jobIdRef.current) return;
+        setStats(event.data.stats);
+        if (event.data.type === 'done') {
+          busyRef.current = false;
+          setComputing(false);
+        }
+      };
+      worker.postMessage({ id, originalCode, modifiedCode, selection: range });
+    }, DIFF_DEBOUNCE_MS);
+
+    return () => clearTimeout(timer);
+  }, [originalCode, modifiedCode, selectionStart, selectionEnd]);
+
+  useEffect(() => () => {
+    workerRef.current?.terminate();
+    workerRef.current = null;
+  }, []);
+
+  return { stats, computing };
+};